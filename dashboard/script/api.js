@@ -11,6 +11,16 @@ export default class Api {
           videoUrl: e.videoUrl,
           frameUrl: e.frameUrl,
           recordedAt: new Date(e.recordedAt),
+          provisional: e.provisional,
+          // smaller media for lists, until the renditions are ready the full size is used
+          thumbnailUrl: e.renditions ? e.renditions.thumbnails[0].url : e.frameUrl,
+          thumbnailSrcset: e.renditions
+            ? e.renditions.thumbnails.map((t) => `${t.url} ${t.width}w`).join(", ")
+            : "",
+          posterUrl: e.renditions ? e.renditions.thumbnails[e.renditions.thumbnails.length - 1].url : e.frameUrl,
+          previewUrl: e.renditions ? e.renditions.previewUrl : e.videoUrl,
+          sprite: e.renditions ? e.renditions.sprite : null,
+          hasRenditions: !!e.renditions,
         }))
       );
 
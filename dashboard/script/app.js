@@ -6,6 +6,10 @@ import inVsOut from "./inVsOut.js";
 import frequencies from "./frequencies.js";
 import modal from "./modal.js";
 
+// events without renditions after this long are cached as they are, eg. when
+// renditions are disabled
+const RENDITIONS_WAIT_MS = 24 * 3600 * 1000;
+
 const init = async () => {
   console.log("initialising app...");
 
@@ -23,7 +27,17 @@ const init = async () => {
 
   events = events.concat(await api.getEvents(latestEventDate))
 
-  cache.set(events)
+  // provisional events are still being processed and may be revised, and recent
+  // events may still be waiting for their renditions, so they are refetched. Only
+  // events older than the first of them are cached as the next fetch starts after
+  // the newest cached event.
+  const renditionsCutoff = Date.now() - RENDITIONS_WAIT_MS;
+  const pending = events
+    .filter((i) => i.provisional || (!i.hasRenditions && i.recordedAt.getTime() > renditionsCutoff))
+    .map((i) => i.recordedAt.getTime());
+  const cacheBefore = pending.length ? Math.min(...pending) : Infinity;
+
+  cache.set(events.filter((i) => i.recordedAt.getTime() < cacheBefore))
 
   timeline.init(cfg, events);
   latestSightings.init(cfg, events);
@@ -1,10 +1,18 @@
-const CACHE_KEY = "petdoor:events";
+// bumped when the cached events change shape, older versions are dropped
+const CACHE_KEY = "petdoor:events:v2";
+const OLD_CACHE_KEYS = ["petdoor:events"];
 
 const clear = () => {
   localStorage.removeItem(CACHE_KEY);
 };
 
+const dropOldVersions = () => {
+  OLD_CACHE_KEYS.forEach((key) => localStorage.removeItem(key));
+};
+
 const get = () => {
+  dropOldVersions();
+
   try {
     const events = localStorage.getItem(CACHE_KEY)
       ? JSON.parse(localStorage.getItem(CACHE_KEY))
@@ -18,9 +26,15 @@ const get = () => {
   }
 };
 
+// events cached without renditions fall back to the full size media
 const preRevive = (event) => ({
   ...event,
   recordedAt: new Date(event.recordedAt),
+  thumbnailUrl: event.thumbnailUrl || event.frameUrl,
+  thumbnailSrcset: event.thumbnailSrcset || "",
+  posterUrl: event.posterUrl || event.frameUrl,
+  previewUrl: event.previewUrl || event.videoUrl,
+  sprite: event.sprite || null,
 });
 
 const set = (events) => {
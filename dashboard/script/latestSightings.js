@@ -12,7 +12,7 @@ export default class LatestSightings {
 
     const sightings = cfg.pets
       .map((pet) => {
-        const event = events.find((i) => i.pets.includes(pet.id));
+        const event = events.find((i) => i.pets.includes(pet.id) && i.videoUrl);
 
         if (!event) {
           return null;
@@ -20,8 +20,8 @@ export default class LatestSightings {
 
         return {
           pet: pet.name,
-          frameUrl: event.frameUrl,
-          videoUrl: event.videoUrl,
+          posterUrl: event.posterUrl,
+          previewUrl: event.previewUrl,
           timeSince: timeago(event.recordedAt) + ' ago',
         };
       })
@@ -19,7 +19,9 @@ export default class Timeline {
     events = events.map((i) => ({
       frameUrl: i.frameUrl,
       videoUrl: i.videoUrl,
-      message: Timeline.renderMessage(cfg, i, idPetMap),
+      thumbnailUrl: i.thumbnailUrl,
+      thumbnailSrcset: i.thumbnailSrcset,
+      message: Timeline.renderMessage(cfg, i, idPetMap) + (i.provisional ? " (processing...)" : ""),
       timeSince: timeago(i.recordedAt) + " ago",
     }));
 
@@ -29,15 +29,41 @@ async def get_events(since: datetime):
         {
             'pets': e['pets'],
             'event': e['event'],
-            'videoUrl': '/public/' + e['video_file_name'],
+            'videoUrl': '/public/' + e['video_file_name'] if e['video_file_name'] else None,
             'frameUrl': '/public/' + e['frame_file_name'],
-            'recordedAt': e['timestamp'].isoformat()
+            'recordedAt': e['timestamp'].isoformat(),
+            'provisional': e['status'] == db.EventStatus.PROVISIONAL,
+            'renditions': api_renditions(e['renditions']),
         }
         for e in events
     ]
 
     return {'events': api_events}
 
+# smaller versions of the media for lists, full resolution is only loaded when a clip is opened
+def api_renditions(renditions):
+    if not renditions:
+        return None
+
+    sprite = renditions['sprite']
+
+    return {
+        'previewUrl': '/public/' + renditions['preview'],
+        'thumbnails': [
+            {'width': int(width), 'url': '/public/' + link_name}
+            for width, link_name in sorted(renditions['thumbnails'].items(), key=lambda t: int(t[0]))
+        ],
+        'sprite': {
+            'url': '/public/' + sprite['file_name'],
+            'columns': sprite['columns'],
+            'rows': sprite['rows'],
+            'tiles': sprite['tiles'],
+            'tileWidth': sprite['tile_width'],
+            'tileHeight': sprite['tile_height'],
+            'intervalS': sprite['interval_s'],
+        },
+    }
+
 app.mount("/public/", StaticFiles(directory=config.VP_PUBLIC_DIR), name="public")
 app.mount("/", StaticFiles(directory="dashboard", html=True), name="dashboard")
 
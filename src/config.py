@@ -31,12 +31,49 @@ class Config:
     MD_NIGHT_PIXEL_CHANGE_THRESHOLD = 15
     MD_IMAGE_CHANGE_THRESHOLD = 0.02
     MD_RESIZE_WIDTH = 240
+    MD_DETECTOR = 'background' # 'background' or 'compare'
+    MD_BG_LEARNING_RATE = 0.05
+    MD_BG_FOREGROUND_LEARNING_RATE = 0.002
+    MD_BG_Z_THRESHOLD = 3.0
+    MD_BG_MIN_STD = 2.0
+    MD_ROI_MASK_PATH = None # grayscale image, non-zero pixels are monitored for motion
+    MD_TILE_GRID = (4, 4) # rows, cols
+    MD_TILE_CHANGE_THRESHOLD = 0.1
+    MD_GLOBAL_CHANGE_TILE_PORTION = 0.75
+    MD_GLOBAL_CHANGE_UNTOUCHED_TILE = 0.02 # tiles changed less than this rule out a global change
     MD_RESOLUTION = (640, 480)
     MD_MIN_DURATION_S = 5
     MD_MAX_DURATION_S = 60
     MD_STILL_FPS = 2
     MD_MOTION_FPS = 10
+    MD_MIN_FPS = 1 / 60
+    MD_FPS_SMOOTHING = 0.1
+    MD_FRAME_COST_SMOOTHING = 0.1
+    MD_FPS_REPORT_INTERVAL_S = 60
+    # max portion of a cpu core the capture loop may use in each temp range
+    MD_TEMP_DUTY_CYCLE = {
+        TempRange.COOL: 1.0,
+        TempRange.HOT: 0.25,
+        TempRange.VERY_HOT: 0.05,
+        TempRange.DANGEROUS: 0.0005,
+    }
+    MD_PRE_ROLL_S = 2
+    # idle the camera pipeline until the thermal camera detects motion
+    MD_THERMAL_GATE_ENABLED = False
+    MD_THERMAL_GATE_IDLE_FPS = 0.2
+    MD_THERMAL_GATE_HEARTBEAT_S = 30
     MD_STORAGE_PATH = "data/video"
+    MD_VIDEO_ENCODER = 'h264' # 'h264' (mp4 via ffmpeg) or 'xvid' (avi, transcoded by the processor)
+    MD_H264_CODEC = 'libx264'
+    MD_H264_PRESET = 'veryfast'
+    MD_H264_CRF = 23
+    MD_H264_THREADS = 1
+    MD_WRITER_QUEUE_FRAMES = 10 # frames buffered for the video writer thread, beyond the pre-roll
+    MD_WRITER_JOIN_TIMEOUT_S = 10 # clips still being written when the recorder exits
+    # shared memory blocks of sampled frames waiting for the processor (about 0.8 MB a
+    # clip, 0.4 MB a live window), beyond this clips are queued without their frames and
+    # the processor decodes the file instead
+    MD_MAX_SHARED_FRAMES = 16
     MD_STORAGE_MAX_AGE = 30 * 24 * 3600
     MD_DAY_BRIGHTNESS = 50
     MD_NIGHT_BRIGHTNESS = 65
@@ -49,12 +86,31 @@ class Config:
     TC_MAX_TEMP_C = 50
     TC_CHANGE_TEMP_PIXEL_THRESHOLD = 2
     TC_CHANGE_TEMP_IMAGE_THRESHOLD_PIXELS = 4
+    TC_DETECTOR = 'background' # 'background' or 'compare'
+    TC_BG_LEARNING_RATE = 0.02
+    TC_BG_FOREGROUND_LEARNING_RATE = 0.001
+    TC_BG_Z_THRESHOLD = 3.0
+    TC_BG_MIN_STD = 0.5
+    TC_MIN_BLOB_PIXELS = 2
+    # (x, y) direction in sensor pixels pointing through the door to the inside
+    TC_INSIDE_DIRECTION = (0, 1)
+    TC_DIRECTION_MIN_FRAMES = 3
+    TC_DIRECTION_FULL_TRAVEL_PX = 4
     TC_STORAGE_PATH = "data/video/ir"
     TC_RESOLUTION = (8, 8)
     TC_MIN_DURATION_S = 3
     TC_MAX_DURATION_S = 15
     TC_STILL_FPS = 2
     TC_MOTION_FPS = 10
+    TC_HEARTBEAT_INTERVAL_S = 10
+    # Leave the sensor's difference-mode interrupt watching for changes while still
+    # and only read the full frame once it flags a pixel (or the refresh is due)
+    TC_INTERRUPT_ENABLED = False
+    TC_INTERRUPT_THRESHOLD_C = 2
+    TC_INTERRUPT_HYSTERESIS_C = 0.5
+    TC_INTERRUPT_REFRESH_S = 60
+    # Wait on the sensor's INT pin (active low) rather than polling the status register
+    TC_INTERRUPT_GPIO_PIN = None
 
     # Auto Updater (AD) config
     AD_INTERVAL_S = 5 * 60
@@ -79,6 +135,21 @@ class Config:
     # Video Classification (VC) config
     VC_INPUT_SHAPE = (15,96,96,3) # dims: frames, w, h, channels
     VC_PREPROCESS_CACHE_PATH = './data/cache/'
+    # 'ffmpeg' runs ffprobe and ffmpeg, 'opencv' decodes in-process in one pass. The
+    # model was trained on ffmpeg's tensors, only switch once `python -m
+    # src.ml.preprocess_benchmark` on real clips and the model's accuracy agree
+    VC_PREPROCESS_DECODER = 'ffmpeg'
+    # classify finished clips from the frames the recorder sampled (scaled by opencv)
+    # rather than preprocessing the clip like the training data. Only enable once
+    # `python -m src.inference_engine [labels json file]` reports the recorder frames
+    # agree, otherwise they are only used to pick the poster
+    VC_USE_RECORDER_FRAMES = False
+    VC_RECORDER_FRAMES_MIN_AGREEMENT = 0.95
+    # live classification of clips while they are still recording
+    VC_LIVE_ENABLED = True
+    VC_LIVE_WINDOW_STRIDE = 5 # sampled frames between live windows
+    VC_LIVE_MAX_WINDOWS = 4 # per clip
+    VC_LIVE_CONFIDENCE_THRESHOLD = 0.8
     VC_PET_CLASSES = {
         'MIA': 1,
         'LUNA': 2,
@@ -103,9 +174,76 @@ class Config:
 
     # Video Processor (VP)
     VP_TFLITE_MODEL_PATH = "./data/model/model.tflite"
+    # int8 model exported by train.py, check it with `python -m src.inference_engine [labels json file]` first
+    VP_TFLITE_QUANTIZED_MODEL_PATH = "./data/model/model.int8.tflite"
+    VP_USE_QUANTIZED_MODEL = False
+    VP_QUANTIZED_MIN_AGREEMENT = 0.95
     VP_FRAMES_DIR = './data/frames/'
     VP_PUBLIC_DIR = './data/public/'
-    VP_FFMPEG_THREADS = 1
+    VP_POSTER_JPEG_QUALITY = 90
+    VP_POSTER_PRESENCE_FLOOR = 0.01 # ranks frames of clips without a clear subject by sharpness alone
+
+    # renditions for the dashboard, see renditions.py
+    VP_RENDITIONS_ENABLED = True
+    VP_RENDITIONS_DIR = './data/renditions/'
+    VP_PREVIEW_WIDTH = 320
+    VP_PREVIEW_CRF = 30
+    VP_PREVIEW_MAX_BITRATE = '250k'
+    VP_THUMBNAIL_WIDTHS = (160, 320)
+    VP_RENDITION_WEBP_QUALITY = 75
+    VP_SPRITE_TILES = 10
+    VP_SPRITE_COLUMNS = 5
+    VP_SPRITE_TILE_WIDTH = 160
+
+    # workers and inference
+    VP_WORKERS = 2
+    VP_FFMPEG_THREADS = 2 # split between the workers for ffmpeg and decoding, see worker_threads
+    VP_INFERENCE_THREADS = 2 # used by the single inference thread, see inference_engine.py
+    VP_INFERENCE_MAX_BATCH = 4 # clips stacked into one invoke
+    VP_INFERENCE_BATCH_WAIT_S = 0.05
+    VP_XNNPACK_DELEGATE_PATH = None # eg. a libtensorflowlite xnnpack delegate .so
+
+    # skip the model for clips whose motion statistics show no animal, see
+    # cascade_no_animal_confidence in processor.py. 'record' only logs the decisions
+    # (and counts missed animals in shared['vp_cascade']) until the thresholds have been
+    # checked against labelled clips, 'enforce' acts on them, 'off' disables it.
+    VP_CASCADE_MODE = 'record'
+    VP_CASCADE_CONFIDENCE = 0.9
+    VP_CASCADE_ANIMAL_CHANGE = 0.05 # peak portion of the frame changed by an animal near the door
+
+    # per stage timings, see instrumentation.py
+    VP_INSTRUMENTATION_ENABLED = True
+    VP_INSTRUMENTATION_WINDOW = 500 # latest samples kept per stage
+    VP_INSTRUMENTATION_DUMP_INTERVAL_S = 60
+    VP_INSTRUMENTATION_PATH = './data/processor-stages.json' # print with `python -m src.instrumentation`
+
+    # persistent job queue, see job_queue.py
+    VP_JOB_QUEUE_PATH = "./data/jobs.sqlite"
+    VP_JOB_CLAIM_BATCH = 4 # jobs claimed at once, also the most in flight
+    VP_JOB_MAX_ATTEMPTS = 3
+    VP_JOB_RETRY_DELAY_S = 60
+    VP_JOB_POLL_INTERVAL_S = 5
+    VP_JOB_RETENTION_S = 7 * 24 * 60 * 60 # finished jobs are kept for a week
+
+    # thermal crossing directions are matched to motion clips recorded at the same time
+    VP_THERMAL_MATCH_SLACK_S = 5
+    VP_THERMAL_RECENT_CLIPS = 20 # most thermal clips matched against each motion clip
+    VP_THERMAL_PRIOR_WEIGHT = 0.5
+    # skip the full clip inference when the live window already identified the pet
+    VP_THERMAL_SKIP_CONFIDENCE = 0.9
+
+    # Retention (RT) config, see retention.py
+    RT_ENABLED = True
+    RT_INTERVAL_S = 15 * 60
+    RT_DISK_BUDGET_BYTES = 16 * 2**30 # media in data/video, frames, public, renditions and cache
+    RT_MIN_FREE_BYTES = 1 * 2**30 # the budget shrinks to keep this much of the card free
+    RT_MIN_AGE_S = 60 * 60 # newer files may still be recording or processing
+    RT_DELETE_BATCH = 20
+    RT_BATCH_PAUSE_S = 1
+    RT_NICENESS = 10
+    RT_COMPACT_AFTER_S = 7 * 24 * 3600
+    RT_COMPACT_WIDTH = 320
+    RT_COMPACT_CRF = 32
 
     # Database
     DB_SQLITE_PATH = "./data/db.sqlite"
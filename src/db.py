@@ -1,7 +1,15 @@
 import sqlite3
+import json
 from datetime import datetime, timezone
 from .config import config
 
+EVENT_COLUMNS = ['timestamp', 'pets', 'event', 'video_file_name', 'frame_file_name', 'clip', 'status', 'renditions']
+
+class EventStatus:
+    # classified from a live window while the clip is still recording
+    PROVISIONAL = 'provisional'
+    CONFIRMED = 'confirmed'
+
 def connect():
     config.logger.info('connecting to sqlite db: %s' % config.DB_SQLITE_PATH)
     connection = sqlite3.connect(config.DB_SQLITE_PATH)
@@ -17,37 +25,126 @@ def migrate_schema(connection):
         )
     ''')
 
+    add_missing_columns(connection, 'pet_door_events', {
+        'clip': 'NULL',
+        'status': "'%s'" % EventStatus.CONFIRMED,
+        # json of the public file names of the smaller versions of the media
+        'renditions': 'NULL',
+        # 1 once the clip has been compacted by the retention service
+        'tier': 0,
+    })
+
+    connection.execute('CREATE INDEX IF NOT EXISTS pet_door_events_clip ON pet_door_events (clip)')
+    connection.commit()
+
+def add_missing_columns(connection, table, columns):
+    existing = [r[1] for r in connection.execute('PRAGMA table_info(%s)' % table).fetchall()]
+
+    for column, default in columns.items():
+        if column not in existing:
+            config.logger.info('adding column %s to %s' % (column, table))
+            connection.execute('ALTER TABLE %s ADD COLUMN %s DEFAULT %s' % (table, column, default))
 
 def insert_event(connection, event):
     config.logger.info('inserting event into db')
 
-    connection.execute('''INSERT INTO pet_door_events VALUES (?, ?, ?, ?, ?)''', (
+    cursor = connection.execute('''INSERT INTO pet_door_events (%s) VALUES (%s)''' % (', '.join(EVENT_COLUMNS), ', '.join('?' for _ in EVENT_COLUMNS)),
+        event_values(event))
+    connection.commit()
+
+    return cursor.lastrowid
+
+def update_event(connection, rowid, event):
+    config.logger.info('updating event %d in db' % rowid)
+
+    connection.execute('''UPDATE pet_door_events SET %s WHERE rowid = ?''' % ', '.join(c + ' = ?' for c in EVENT_COLUMNS),
+        event_values(event) + (rowid,))
+    connection.commit()
+
+def update_event_renditions(connection, rowid, renditions):
+    config.logger.info('updating renditions of event %d in db' % rowid)
+
+    connection.execute('''UPDATE pet_door_events SET renditions = ? WHERE rowid = ?''',
+        (json.dumps(renditions) if renditions else None, rowid))
+    connection.commit()
+
+def delete_event(connection, rowid):
+    config.logger.info('deleting event %d from db' % rowid)
+
+    connection.execute('''DELETE FROM pet_door_events WHERE rowid = ?''', (rowid,))
+    connection.commit()
+
+def delete_events(connection, rowids):
+    if not rowids:
+        return
+
+    config.logger.info('deleting %d events from db' % len(rowids))
+
+    connection.executemany('''DELETE FROM pet_door_events WHERE rowid = ?''', [(r,) for r in rowids])
+    connection.commit()
+
+def update_event_tier(connection, rowid, tier):
+    connection.execute('''UPDATE pet_door_events SET tier = ? WHERE rowid = ?''', (tier, rowid))
+    connection.commit()
+
+def event_values(event):
+    return (
         event['timestamp'].astimezone(tz=timezone.utc).isoformat(),
         ','.join([str(x) for x in event['pets']]),
         event['event'],
         event['video_file_name'],
-        event['frame_file_name']
-    ))
-    connection.commit()
+        event['frame_file_name'],
+        event.get('clip'),
+        event.get('status', EventStatus.CONFIRMED),
+        json.dumps(event['renditions']) if event.get('renditions') else None,
+    )
+
+def select_event_by_clip(connection, clip):
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT rowid, %s FROM pet_door_events
+        WHERE clip = ?
+    ''' % ', '.join(EVENT_COLUMNS), (clip,))
+
+    rows = cursor.fetchall()
+
+    return parse_event_row(rows[0]) if rows else None
 
 def select_recent_events(connection, since):
     config.logger.info('fetching events since %s from db' % since.isoformat())
 
     cursor = connection.cursor()
     cursor.execute('''
-        SELECT * FROM pet_door_events 
+        SELECT rowid, %s FROM pet_door_events
         WHERE timestamp >= ?
         ORDER BY timestamp DESC
-    ''', (since.astimezone(tz=timezone.utc).isoformat(), ))
+    ''' % ', '.join(EVENT_COLUMNS), (since.astimezone(tz=timezone.utc).isoformat(), ))
 
     rows = cursor.fetchall()
 
-    return [
-        {
-            'timestamp': datetime.strptime(r[0], "%Y-%m-%dT%H:%M:%S.%f%z"),
-            'pets': [int(x) for x in r[1].split(',')],
-            'event': int(r[2]),
-            'video_file_name': r[3],
-            'frame_file_name': r[4]
-        } for r in rows
-    ]
\ No newline at end of file
+    return [parse_event_row(r) for r in rows]
+
+def parse_event_row(r):
+    return {
+        'id': r[0],
+        'timestamp': datetime.strptime(r[1], "%Y-%m-%dT%H:%M:%S.%f%z"),
+        'pets': [int(x) for x in r[2].split(',')],
+        'event': int(r[3]),
+        'video_file_name': r[4],
+        'frame_file_name': r[5],
+        'clip': r[6],
+        'status': r[7],
+        'renditions': json.loads(r[8]) if r[8] else None,
+    }
+
+# events with a clip recorded before the given time which have not been compacted yet
+def select_events_to_compact(connection, before, limit):
+    cursor = connection.cursor()
+    cursor.execute('''
+        SELECT rowid, %s FROM pet_door_events
+        WHERE timestamp < ? AND tier = 0 AND video_file_name IS NOT NULL
+        ORDER BY timestamp
+        LIMIT ?
+    ''' % ', '.join(EVENT_COLUMNS), (before.astimezone(tz=timezone.utc).isoformat(), limit))
+
+    return [parse_event_row(r) for r in cursor.fetchall()]
@@ -0,0 +1,145 @@
+from multiprocessing import shared_memory, resource_tracker
+import threading
+import uuid
+import math
+import os
+import numpy as np
+
+from .config import config
+
+# Fixed-size ring of frames backed by shared memory, used to keep a few seconds
+# of pre-roll before motion is detected. All memory is allocated up front so the
+# footprint is constant regardless of how long the recorder runs. Slots can be
+# pinned while a frame is waiting to be written, pinned slots are not overwritten.
+class FrameRingBuffer:
+    def __init__(self, capacity, frame_shape, dtype='uint8', name=None):
+        self.capacity = capacity
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+
+        size = capacity * int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.frames = np.ndarray((capacity,) + self.frame_shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.timestamps = np.full((capacity,), -np.inf, dtype='float64')
+        self.pins = np.zeros((capacity,), dtype='int32')
+        self.pins_lock = threading.Lock()
+        self.next_index = 0
+        self.count = 0
+
+        config.logger.info('allocated %d frame ring buffer (%.1f MB shared memory)' % (capacity, size / 1024 / 1024))
+
+    # copies the frame into the next slot and returns a view of the slot, or None
+    # if the slot is still pinned by a pending write
+    def push(self, frame, timestamp):
+        slot = self.next_index
+
+        if self.pins[slot]:
+            return None
+
+        np.copyto(self.frames[slot], frame)
+        self.timestamps[slot] = timestamp
+
+        self.next_index = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        return self.frames[slot]
+
+    # returns (timestamp, view) of the buffered frames captured at or after since,
+    # oldest first
+    def frames_since(self, since):
+        start = (self.next_index - self.count) % self.capacity
+        slots = [(start + i) % self.capacity for i in range(self.count)]
+
+        return [(self.timestamps[s], self.frames[s]) for s in slots if self.timestamps[s] >= since]
+
+    def pin(self, frame):
+        slot = self.slot_of(frame)
+        if slot is not None:
+            with self.pins_lock:
+                self.pins[slot] += 1
+
+    def unpin(self, frame):
+        slot = self.slot_of(frame)
+        if slot is not None:
+            with self.pins_lock:
+                self.pins[slot] -= 1
+
+    def slot_of(self, frame):
+        offset = frame.ctypes.data - self.frames.ctypes.data
+        if offset < 0 or offset >= self.frames.nbytes:
+            return None
+
+        return offset // self.frames[0].nbytes
+
+    def clear(self):
+        self.timestamps[:] = -np.inf
+        self.count = 0
+
+    def close(self):
+        del self.frames
+        self.shm.close()
+        self.shm.unlink()
+
+def create_pre_roll_buffer():
+    # extra slots leave room for frames queued to be written while the pre-roll is flushed
+    capacity = max(1, math.ceil(config.MD_PRE_ROLL_S * config.MD_MOTION_FPS)) + config.MD_WRITER_QUEUE_FRAMES
+    frame_shape = (config.MD_RESOLUTION[1], config.MD_RESOLUTION[0], 3)
+
+    # unique to the process, a recorder which is restarted can not unlink the block
+    # of the one replacing it
+    name = 'smartpetdoor-pre-roll-' + uuid.uuid4().hex[:8]
+
+    return FrameRingBuffer(capacity, frame_shape, name=name)
+
+SHARED_FRAMES_PREFIX = 'smartpetdoor-frames-'
+SHM_DIR = '/dev/shm'
+
+# A uint8 array in a named shared memory block which is handed between processes.
+# The creating process gives up ownership once the handle is sent, the receiving
+# process attaches using the handle and unlinks the block when finished with it.
+class SharedFrames:
+    def __init__(self, shm, shape):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.array = np.ndarray(self.shape, dtype='uint8', buffer=shm.buf)
+
+    @staticmethod
+    def create(shape):
+        name = SHARED_FRAMES_PREFIX + uuid.uuid4().hex[:8]
+        shm = shared_memory.SharedMemory(name=name, create=True, size=int(np.prod(shape)))
+        return SharedFrames(shm, shape)
+
+    # Blocks which exist in any process, ie. created or handed off and not yet released
+    # by the processor. /dev/shm is ram, so a stopped or lagging processor would
+    # otherwise let them grow without bound. 0 where there is no /dev/shm to count.
+    @staticmethod
+    def outstanding():
+        try:
+            return sum(1 for name in os.listdir(SHM_DIR) if name.startswith(SHARED_FRAMES_PREFIX))
+        except FileNotFoundError:
+            return 0
+
+    # whether another block may be handed off, see MD_MAX_SHARED_FRAMES
+    @staticmethod
+    def can_hand_off(own=0):
+        return SharedFrames.outstanding() - own < config.MD_MAX_SHARED_FRAMES
+
+    @staticmethod
+    def attach(handle):
+        return SharedFrames(shared_memory.SharedMemory(name=handle['name']), handle['shape'])
+
+    def handle(self):
+        return {'name': self.shm.name, 'shape': self.shape}
+
+    # closes this process' mapping and leaves the block for the receiving process
+    def hand_off(self):
+        del self.array
+        self.shm.close()
+        # stop this process' resource tracker unlinking the block when it exits
+        resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+    def release(self):
+        del self.array
+        self.shm.close()
+        self.shm.unlink()
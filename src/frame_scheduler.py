@@ -0,0 +1,100 @@
+from time import sleep, monotonic
+
+from .config import config, TempRange
+
+# Paces a capture loop against frame deadlines rather than sleeping a fixed
+# interval after each frame, so processing time is accounted for. The rate is
+# governed by a cpu duty cycle budget (measured frame cost * fps) that shrinks
+# as the cpu heats up, and moves towards the governed rate gradually.
+class FrameScheduler:
+    def __init__(self, name, shared, fps_by_state):
+        self.name = name
+        self.shared = shared
+        self.fps_by_state = fps_by_state
+
+        self.frame_started_at = None
+        self.state = None
+        self.deadline = None
+        self.frame_cost = None
+        self.fps = None
+
+        self.report_started_at = monotonic()
+        self.report_frames = 0
+        self.report_missed = 0
+
+    def start_frame(self):
+        self.frame_started_at = monotonic()
+
+    # sleeps until the deadline of the next frame, or until the wake event is set
+    def wait(self, state, wake=None):
+        now = monotonic()
+        cost = now - self.frame_started_at
+
+        if self.frame_cost is None:
+            self.frame_cost = cost
+        else:
+            self.frame_cost += (cost - self.frame_cost) * config.MD_FRAME_COST_SMOOTHING
+
+        target_fps = self.fps_by_state[state]
+        governed_fps = self.governed_fps(target_fps)
+
+        # jump straight to the new rate on state changes, otherwise ease towards it
+        if state != self.state:
+            self.state = state
+            self.fps = governed_fps
+        else:
+            self.fps += (governed_fps - self.fps) * config.MD_FPS_SMOOTHING
+
+        interval = 1 / self.fps
+
+        if self.deadline is None:
+            self.deadline = self.frame_started_at
+        self.deadline += interval
+
+        # the frame overran by more than a whole interval, don't try to catch up
+        if now > self.deadline + interval:
+            self.report_missed += 1
+            self.deadline = now
+
+        self.report_frames += 1
+        self.report(target_fps)
+
+        if wake is None:
+            sleep(max(0, self.deadline - now))
+        elif wake.wait(max(0, self.deadline - now)):
+            self.deadline = monotonic()
+
+    def governed_fps(self, target_fps):
+        duty_cycle = config.MD_TEMP_DUTY_CYCLE[self.temp_range()]
+        max_fps = duty_cycle / self.frame_cost if self.frame_cost > 0 else target_fps
+
+        return max(config.MD_MIN_FPS, min(target_fps, max_fps))
+
+    def temp_range(self):
+        if 'temp' in self.shared and 'range' in self.shared['temp']:
+            return self.shared['temp']['range']
+
+        return TempRange.COOL
+
+    def report(self, target_fps):
+        elapsed = monotonic() - self.report_started_at
+
+        if elapsed < config.MD_FPS_REPORT_INTERVAL_S:
+            return
+
+        achieved_fps = self.report_frames / elapsed
+        stats = {
+            'target_fps': target_fps,
+            'governed_fps': self.fps,
+            'achieved_fps': achieved_fps,
+            'frame_cost_s': self.frame_cost,
+            'missed_deadlines': self.report_missed,
+        }
+
+        config.logger.info('[%s] achieved %.2f fps (target %.2f, governed %.2f, frame cost %.1f ms, %d missed deadlines)'
+            % (self.name, achieved_fps, target_fps, self.fps, self.frame_cost * 1000, self.report_missed))
+        self.shared[self.name + '_fps'] = stats
+
+        self.report_started_at = monotonic()
+        self.report_frames = 0
+        self.report_missed = 0
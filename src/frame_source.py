@@ -0,0 +1,97 @@
+from .config import config
+
+from imutils.video import VideoStream
+from time import sleep, monotonic
+import cv2
+import os
+from sys import platform
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi')
+
+# Frame sources provide the recorder with BGR frames at MD_RESOLUTION,
+# read() returns None once no more frames are available
+
+class CameraFrameSource:
+    def __init__(self):
+        self.vs = VideoStream(src=0, resolution=config.MD_RESOLUTION, usePiCamera='linux' in platform)
+        self.vs_stream = None
+
+    def start(self):
+        self.vs_stream = self.vs.start()
+        sleep(5.0)
+
+    def read(self):
+        return self.vs_stream.read()
+
+    def set_brightness(self, brightness):
+        if hasattr(self.vs.stream, 'camera'):
+            self.vs.stream.camera.brightness = brightness
+
+    def stop(self):
+        self.vs_stream.stop()
+
+# Replays a video file, or every video in a directory in name order. When realtime
+# is set read() returns the frame matching the elapsed wall time, skipping frames as
+# a live camera would, otherwise every frame is returned as fast as it is read.
+class FileFrameSource:
+    def __init__(self, path, realtime=True):
+        if os.path.isdir(path):
+            self.paths = [os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(VIDEO_EXTENSIONS)]
+        else:
+            self.paths = [path]
+
+        self.realtime = realtime
+        self.capture = None
+        self.capture_fps = None
+        self.capture_started_at = None
+        self.frame_index = 0
+
+    def start(self):
+        config.logger.info('replaying %d video(s) from disk' % len(self.paths))
+
+    def read(self):
+        while True:
+            if self.capture is None and not self.open_next():
+                return None
+
+            if self.realtime:
+                target_index = int((monotonic() - self.capture_started_at) * self.capture_fps)
+                while self.frame_index < target_index and self.capture.grab():
+                    self.frame_index += 1
+
+            ok, frame = self.capture.read()
+
+            if ok:
+                self.frame_index += 1
+                return self.resize(frame)
+
+            self.capture.release()
+            self.capture = None
+
+    def open_next(self):
+        if not self.paths:
+            return False
+
+        path = self.paths.pop(0)
+        config.logger.info('replaying %s' % path)
+
+        self.capture = cv2.VideoCapture(path)
+        self.capture_fps = self.capture.get(cv2.CAP_PROP_FPS) or config.MD_MOTION_FPS
+        self.capture_started_at = monotonic()
+        self.frame_index = 0
+
+        return True
+
+    def resize(self, frame):
+        if (frame.shape[1], frame.shape[0]) != config.MD_RESOLUTION:
+            frame = cv2.resize(frame, config.MD_RESOLUTION)
+
+        return frame
+
+    def set_brightness(self, brightness):
+        pass
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
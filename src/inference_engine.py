@@ -0,0 +1,237 @@
+import tflite_runtime.interpreter as tflite
+from queue import SimpleQueue, Empty
+from time import monotonic
+import threading
+import json
+import sys
+import os
+import numpy as np
+
+from .config import config
+from .instrumentation import stage
+
+class InferenceRequest:
+    def __init__(self, model_input):
+        self.model_input = model_input
+        self.done = threading.Event()
+        self.prediction = None
+        self.error = None
+
+# Runs the tflite model on a single thread for every worker, inputs submitted while
+# the model is busy (or within VP_INFERENCE_BATCH_WAIT_S) are stacked into one batch
+# per invoke. The input tensor is resized to the batch size and inputs are written
+# straight into the interpreter's buffer rather than copied with set_tensor.
+class InferenceEngine:
+    def __init__(self, model_path, num_threads=None, max_batch=1, batch_wait_s=0.0, xnnpack_delegate_path=None):
+        self.max_batch = max(1, max_batch)
+        self.batch_wait_s = batch_wait_s
+        self.requests = SimpleQueue()
+
+        delegates = []
+        if xnnpack_delegate_path:
+            try:
+                delegates.append(tflite.load_delegate(xnnpack_delegate_path))
+            except (ValueError, OSError) as e:
+                config.logger.warning('could not load xnnpack delegate %s, using the default kernels' % xnnpack_delegate_path, exc_info=e)
+
+        config.logger.info('loading tflite model from %s (%d threads, batches of up to %d)' % (model_path, num_threads or 1, self.max_batch))
+        self.interpreter = tflite.Interpreter(model_path=model_path, num_threads=num_threads, experimental_delegates=delegates or None)
+        self.interpreter.allocate_tensors()
+
+        input_details = self.interpreter.get_input_details()[0]
+        self.input_index = input_details['index']
+        self.input_shape = tuple(input_details['shape'][1:])
+        self.batch_size = input_details['shape'][0]
+
+        # quantized models take and return integers, (scale, zero point) map them to reals
+        self.input_quantization = input_details['quantization']
+        self.quantized = input_details['dtype'] != np.float32
+
+        if self.quantized:
+            # rgb24 bytes map to the quantized input through a 256 entry table, which
+            # is the identity when the model was calibrated on 0-1 inputs
+            scale, zero_point = self.input_quantization
+            info = np.iinfo(input_details['dtype'])
+            self.input_table = np.clip(np.round(np.arange(256) / 255 / scale + zero_point), info.min, info.max).astype(input_details['dtype'])
+            self.input_table_identity = np.array_equal(self.input_table, np.arange(256))
+
+        output_details = self.interpreter.get_output_details()[0]
+        self.output_index = output_details['index']
+        self.output_quantization = output_details['quantization']
+
+        self.batches = 0
+        self.invoked = 0
+
+        self.thread = threading.Thread(target=self.run, name='inference engine', daemon=True)
+        self.thread.start()
+        config.logger.info('loaded model')
+
+    # returns the class probabilities for a single model input, blocks until the
+    # batch it is part of has been invoked
+    def predict(self, model_input):
+        request = InferenceRequest(model_input)
+
+        # includes waiting for the batch and any batch ahead of it
+        with stage('predict'):
+            self.requests.put(request)
+            request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+
+        return request.prediction
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = monotonic() + self.batch_wait_s
+
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.requests.get(timeout=max(0, deadline - monotonic())))
+                except Empty:
+                    break
+
+            try:
+                predictions = self.invoke(batch)
+                for request, prediction in zip(batch, predictions):
+                    request.prediction = prediction
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+
+            for request in batch:
+                request.done.set()
+
+    def invoke(self, batch):
+        if len(batch) != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, (len(batch),) + self.input_shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = len(batch)
+
+        # the view must be released before invoke(), tflite refuses to run while
+        # references to its buffers are held
+        input_tensor = self.interpreter.tensor(self.input_index)()
+        for i, request in enumerate(batch):
+            self.write_input(input_tensor[i], request.model_input)
+        del input_tensor
+
+        with stage('invoke'):
+            self.interpreter.invoke()
+        self.batches += 1
+        self.invoked += len(batch)
+
+        output = self.interpreter.get_tensor(self.output_index)
+
+        if output.dtype != np.float32:
+            scale, zero_point = self.output_quantization
+            output = (output.astype('float32') - zero_point) * scale
+
+        return output
+
+    # model inputs are either rgb24 frames (uint8) or already scaled to 0-1 (float)
+    def write_input(self, dest, model_input):
+        model_input = model_input.reshape(self.input_shape)
+        is_bytes = model_input.dtype == np.uint8
+
+        if not self.quantized:
+            if is_bytes:
+                # raw frames are scaled into the float tensor in one pass
+                np.multiply(model_input, 1 / 255, out=dest, casting='unsafe')
+            else:
+                np.copyto(dest, model_input, casting='unsafe')
+            return
+
+        if is_bytes and self.input_table_identity:
+            # the decoded bytes are the quantized values
+            np.copyto(dest, model_input, casting='unsafe')
+        elif is_bytes:
+            np.take(self.input_table, model_input, out=dest)
+        else:
+            scale, zero_point = self.input_quantization
+            info = np.iinfo(dest.dtype)
+            np.copyto(dest, np.clip(np.round(model_input / scale + zero_point), info.min, info.max), casting='unsafe')
+
+def load_inference_engine(quantized=None):
+    if quantized is None:
+        quantized = config.VP_USE_QUANTIZED_MODEL
+
+    return InferenceEngine(
+        config.VP_TFLITE_QUANTIZED_MODEL_PATH if quantized else config.VP_TFLITE_MODEL_PATH,
+        num_threads=config.VP_INFERENCE_THREADS,
+        max_batch=config.VP_INFERENCE_MAX_BATCH,
+        batch_wait_s=config.VP_INFERENCE_BATCH_WAIT_S,
+        xnnpack_delegate_path=config.VP_XNNPACK_DELEGATE_PATH,
+    )
+
+# Compares the quantized model with the float model on the held out test clips of
+# the dataset, which were neither trained on nor used to calibrate the quantization,
+# fed as rgb24 bytes the way the processor does. Returns the portion of clips where
+# both models predict the same class.
+def check_quantized_parity(float_engine, quantized_engine, videos):
+    from .ml.preprocess import preprocess_video
+
+    agree = 0
+    max_diff = 0.0
+    total_diff = 0.0
+
+    for video in videos:
+        tensor = preprocess_video(video, cache=True)
+        frames = np.round(tensor * 255).astype('uint8')
+
+        expected = float_engine.predict(frames)
+        actual = quantized_engine.predict(frames)
+
+        agree += int(np.argmax(expected) == np.argmax(actual))
+        diff = float(np.abs(expected - actual).max())
+        max_diff = max(max_diff, diff)
+        total_diff += diff
+
+    agreement = agree / len(videos)
+    config.logger.info('quantized model agrees on %d/%d clips (%.1f%%), max probability diff %.3f, mean %.3f' % (
+        agree, len(videos), agreement * 100, max_diff, total_diff / len(videos)))
+
+    return agreement
+
+# Compares the model's predictions on the training preprocessing (ffmpeg) with the
+# frames scaled and sampled in-process the way the recorder does, see
+# VC_USE_RECORDER_FRAMES. Returns the portion of clips with the same class.
+def check_recorder_frames_parity(engine, videos):
+    from .ml.preprocess import preprocess_video, decode_frames
+
+    agree = 0
+    total_diff = 0.0
+
+    for video in videos:
+        expected = engine.predict(np.round(preprocess_video(video, cache=True, decoder='ffmpeg') * 255).astype('uint8'))
+        actual = engine.predict(decode_frames(video))
+
+        agree += int(np.argmax(expected) == np.argmax(actual))
+        total_diff += float(np.abs(expected - actual).max())
+
+    agreement = agree / len(videos)
+    config.logger.info('recorder frames agree with the training preprocessing on %d/%d clips (%.1f%%), mean max probability diff %.3f' % (
+        agree, len(videos), agreement * 100, total_diff / len(videos)))
+
+    return agreement
+
+if __name__ == '__main__':
+    from .ml.dataset import split_dataset
+
+    if len(sys.argv) < 2:
+        print('usage: python -msrc.inference_engine [labels json file]')
+        sys.exit(1)
+
+    _, _, test_vids = split_dataset(json.load(open(sys.argv[1], 'r')))
+    videos = [item['video'] for item in test_vids if os.path.isfile(item['video'])]
+
+    if not videos:
+        print('no test clips of %s on disk to compare with' % sys.argv[1])
+        sys.exit(1)
+
+    float_engine = load_inference_engine(quantized=False)
+    quantized_agreement = check_quantized_parity(float_engine, load_inference_engine(quantized=True), videos)
+    recorder_agreement = check_recorder_frames_parity(load_inference_engine(), videos)
+
+    sys.exit(0 if quantized_agreement >= config.VP_QUANTIZED_MIN_AGREEMENT
+        and recorder_agreement >= config.VC_RECORDER_FRAMES_MIN_AGREEMENT else 1)
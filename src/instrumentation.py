@@ -0,0 +1,194 @@
+from contextlib import nullcontext
+from collections import deque
+from time import monotonic, thread_time
+import threading
+import functools
+import resource
+import json
+import sys
+import os
+import numpy as np
+
+from .config import config
+
+# Per-stage timing for the video processor. Each stage keeps its latest samples of
+# wall time, cpu time (of the calling thread), cpu time of the child processes (ffmpeg,
+# ffprobe) which finished during the stage and the process' current rss, summarised
+# as percentiles and a histogram by dump(). Children are counted per process, so a
+# stage also picks up children another worker reaped at the same time. Inference runs
+# on its own thread, its cpu time is under 'invoke' rather than the waiting 'predict'. When disabled, stage() returns a shared
+# no-op context manager so the instrumented code pays only for one call.
+
+HISTOGRAM_EDGES_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+NOOP = nullcontext()
+
+class Stage:
+    def __init__(self, name, window):
+        self.name = name
+        self.wall_s = deque(maxlen=window)
+        self.cpu_s = deque(maxlen=window)
+        self.child_cpu_s = deque(maxlen=window)
+        self.count = 0
+        self.total_wall_s = 0.0
+        # highest rss seen when the stage finished
+        self.max_rss_kb = 0
+        # how often the process' rss grew during this stage, other threads included
+        self.rss_growths = 0
+        # stages are recorded from every worker thread
+        self.lock = threading.Lock()
+
+    def record(self, wall_s, cpu_s, child_cpu_s, rss_before_kb, rss_after_kb):
+        with self.lock:
+            self.wall_s.append(wall_s)
+            self.cpu_s.append(cpu_s)
+            self.child_cpu_s.append(child_cpu_s)
+            self.count += 1
+            self.total_wall_s += wall_s
+            self.max_rss_kb = max(self.max_rss_kb, rss_after_kb)
+            self.rss_growths += int(rss_after_kb > rss_before_kb)
+
+    def summary(self):
+        with self.lock:
+            wall_ms = np.array(self.wall_s) * 1000
+            cpu_ms = np.array(self.cpu_s) * 1000
+            child_cpu_ms = np.array(self.child_cpu_s) * 1000
+            count, total_wall_s, max_rss_kb, rss_growths = self.count, self.total_wall_s, self.max_rss_kb, self.rss_growths
+
+        if not len(wall_ms):
+            return {'count': count}
+
+        counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, wall_ms), minlength=len(HISTOGRAM_EDGES_MS) + 1)
+        labels = ['<%dms' % e for e in HISTOGRAM_EDGES_MS] + ['>=%dms' % HISTOGRAM_EDGES_MS[-1]]
+
+        return {
+            'count': count,
+            'total_s': round(total_wall_s, 3),
+            'window': len(wall_ms),
+            'wall_ms': {
+                'mean': round(float(wall_ms.mean()), 2),
+                'p50': round(float(np.percentile(wall_ms, 50)), 2),
+                'p90': round(float(np.percentile(wall_ms, 90)), 2),
+                'p99': round(float(np.percentile(wall_ms, 99)), 2),
+                'max': round(float(wall_ms.max()), 2),
+            },
+            'cpu_ms': {
+                'mean': round(float(cpu_ms.mean()), 2),
+                'max': round(float(cpu_ms.max()), 2),
+            },
+            'child_cpu_ms': {
+                'mean': round(float(child_cpu_ms.mean()), 2),
+                'max': round(float(child_cpu_ms.max()), 2),
+            },
+            'max_rss_kb': max_rss_kb,
+            'rss_growths': rss_growths,
+            'histogram': {label: int(c) for label, c in zip(labels, counts) if c},
+        }
+
+class StageTimer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.rss_kb = rss_kb()
+        self.cpu = thread_time()
+        self.child_cpu = children_cpu_time()
+        self.started_at = monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        wall_s = monotonic() - self.started_at
+        cpu_s = thread_time() - self.cpu
+        child_cpu_s = children_cpu_time() - self.child_cpu
+        self.stage.record(wall_s, cpu_s, child_cpu_s, self.rss_kb, rss_kb())
+        return False
+
+stages = {}
+stages_lock = threading.Lock()
+last_dump_at = 0
+
+PAGE_SIZE_KB = os.sysconf('SC_PAGE_SIZE') // 1024 if hasattr(os, 'sysconf') else 4
+
+# The current rss, rather than ru_maxrss which is the peak over the process' lifetime
+# and so stops changing once any stage has reached it. Falls back to the peak where
+# there is no /proc.
+def rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE_KB
+    except (FileNotFoundError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# user and system time of the child processes which have been waited for
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+# with stage('transcode'): ...
+def stage(name):
+    if not config.VP_INSTRUMENTATION_ENABLED:
+        return NOOP
+
+    instrumented = stages.get(name)
+    if instrumented is None:
+        with stages_lock:
+            instrumented = stages.setdefault(name, Stage(name, config.VP_INSTRUMENTATION_WINDOW))
+
+    return StageTimer(instrumented)
+
+# decorator form of stage() for instrumenting a whole function
+def timed(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def dump():
+    with stages_lock:
+        current = list(stages.values())
+
+    return {s.name: s.summary() for s in current}
+
+# publishes the summary to the shared state and a json file, at most once per
+# VP_INSTRUMENTATION_DUMP_INTERVAL_S
+def export(shared, force=False):
+    global last_dump_at
+
+    if not config.VP_INSTRUMENTATION_ENABLED:
+        return
+
+    if not force and monotonic() - last_dump_at < config.VP_INSTRUMENTATION_DUMP_INTERVAL_S:
+        return
+
+    last_dump_at = monotonic()
+    summary = dump()
+    shared['vp_stages'] = summary
+
+    os.makedirs(os.path.dirname(os.path.realpath(config.VP_INSTRUMENTATION_PATH)), exist_ok=True)
+    part_path = config.VP_INSTRUMENTATION_PATH + '.part'
+    with open(part_path, 'w') as f:
+        json.dump({'dumped_at': last_dump_at, 'stages': summary}, f, indent=2)
+    os.replace(part_path, config.VP_INSTRUMENTATION_PATH)
+
+def format_summary(summary):
+    lines = ['%-18s %7s %10s %10s %10s %10s %10s %12s %12s' % (
+        'stage', 'count', 'mean ms', 'p50 ms', 'p90 ms', 'max ms', 'cpu ms', 'child cpu ms', 'max rss MB')]
+
+    for name, s in sorted(summary.items(), key=lambda i: -i[1].get('total_s', 0)):
+        if 'wall_ms' not in s:
+            continue
+        lines.append('%-18s %7d %10.1f %10.1f %10.1f %10.1f %10.1f %12.1f %12.1f' % (
+            name, s['count'], s['wall_ms']['mean'], s['wall_ms']['p50'], s['wall_ms']['p90'],
+            s['wall_ms']['max'], s['cpu_ms']['mean'], s.get('child_cpu_ms', {}).get('mean', 0), s['max_rss_kb'] / 1024))
+
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    # prints the latest summary written by a running processor
+    path = sys.argv[1] if len(sys.argv) > 1 else config.VP_INSTRUMENTATION_PATH
+
+    with open(path) as f:
+        print(format_summary(json.load(f)['stages']))
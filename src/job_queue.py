@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+import json
+import os
+from time import time, sleep
+
+from .config import config
+
+# live windows go first, then motion clips, then thermal clips, the dashboard
+# renditions of processed clips are made in the background
+JOB_PRIORITIES = {
+    'motion_window': 0,
+    'motion': 1,
+    'thermal': 2,
+    'renditions': 3,
+}
+
+class JobStatus:
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+# Durable replacement for the multiprocessing Queue between the recorders and the
+# video processor. Clips are stored in a sqlite table, so a crash, restart or auto
+# update only delays them: jobs left running by a previous processor go back to
+# pending on startup and the backlog drains. Each thread opens its own connection,
+# the queue itself can be passed to Process() like the Queue it replaces.
+class JobQueue:
+    def __init__(self, path, notify=None):
+        self.path = path
+        # set whenever a job is added, so the processor does not need to poll quickly
+        self.notify = notify
+        self.local = threading.local()
+
+    def __getstate__(self):
+        return {'path': self.path, 'notify': self.notify}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['notify'])
+
+    def connect(self):
+        if getattr(self.local, 'connection', None) is None:
+            os.makedirs(os.path.dirname(os.path.realpath(self.path)), exist_ok=True)
+            # autocommit, transactions are started explicitly where needed
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS clip_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    type, priority, payload, status, attempts, error, created_at, updated_at
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS clip_jobs_status ON clip_jobs (status, priority, id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS clip_jobs_type ON clip_jobs (type, created_at)')
+            self.local.connection = connection
+
+        return self.local.connection
+
+    def put(self, message):
+        priority = JOB_PRIORITIES.get(message['type'], len(JOB_PRIORITIES))
+
+        self.connect().execute('''
+            INSERT INTO clip_jobs (type, priority, payload, status, attempts, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 0, ?, ?)
+        ''', (message['type'], priority, json.dumps(message), JobStatus.PENDING, time(), time()))
+
+        if self.notify is not None:
+            self.notify.set()
+
+    # atomically marks up to limit pending jobs as running and returns them as
+    # (job id, message), highest priority (lowest value) then oldest first. Failed
+    # jobs are only retried after VP_JOB_RETRY_DELAY_S. The time the job was queued is
+    # added to the message as queued_at.
+    def claim(self, limit):
+        connection = self.connect()
+        connection.execute('BEGIN IMMEDIATE')
+
+        try:
+            rows = connection.execute('''
+                SELECT id, payload, created_at FROM clip_jobs
+                WHERE status = ? AND (error IS NULL OR updated_at < ?)
+                ORDER BY priority, id
+                LIMIT ?
+            ''', (JobStatus.PENDING, time() - config.VP_JOB_RETRY_DELAY_S, limit)).fetchall()
+
+            connection.executemany('''
+                UPDATE clip_jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?
+            ''', [(JobStatus.RUNNING, time(), r[0]) for r in rows])
+
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+        jobs = []
+        for job_id, payload, created_at in rows:
+            message = json.loads(payload)
+            message.setdefault('queued_at', created_at)
+            jobs.append((job_id, message))
+
+        return jobs
+
+    # blocks until at least one job can be claimed
+    def wait_and_claim(self, limit):
+        while True:
+            if self.notify is not None:
+                self.notify.clear()
+
+            jobs = self.claim(limit)
+            if jobs:
+                return jobs
+
+            if self.notify is not None:
+                self.notify.wait(config.VP_JOB_POLL_INTERVAL_S)
+            else:
+                sleep(config.VP_JOB_POLL_INTERVAL_S)
+
+    def complete(self, job_id):
+        self.set_status(job_id, JobStatus.DONE)
+
+    # records progress of a job, so a retry does not repeat steps which cannot be
+    def update(self, job_id, message):
+        self.connect().execute('''
+            UPDATE clip_jobs SET payload = ?, updated_at = ? WHERE id = ?
+        ''', (json.dumps(message), time(), job_id))
+
+    # retries the job later unless it has used all of its attempts, returns the new status
+    def fail(self, job_id, error):
+        connection = self.connect()
+        attempts = connection.execute('SELECT attempts FROM clip_jobs WHERE id = ?', (job_id,)).fetchone()[0]
+        status = JobStatus.PENDING if attempts < config.VP_JOB_MAX_ATTEMPTS else JobStatus.FAILED
+
+        config.logger.warning('job %d failed (attempt %d), marking as %s' % (job_id, attempts, status))
+        self.set_status(job_id, status, str(error))
+
+        return status
+
+    def set_status(self, job_id, status, error=None):
+        self.connect().execute('''
+            UPDATE clip_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?
+        ''', (status, error, time(), job_id))
+
+    # thermal clip messages queued since the given time, in any state, so their
+    # crossing direction is available before (and after) the jobs are processed
+    def thermal_clips_since(self, since):
+        rows = self.connect().execute('''
+            SELECT payload FROM clip_jobs
+            WHERE type = 'thermal' AND created_at >= ?
+            ORDER BY id
+            LIMIT ?
+        ''', (since, config.VP_THERMAL_RECENT_CLIPS)).fetchall()
+
+        return [json.loads(r[0]) for r in rows]
+
+    # whether the finished clip recorded at path has been queued, its live windows are
+    # then of no use
+    def has_motion_job(self, path, since):
+        row = self.connect().execute('''
+            SELECT 1 FROM clip_jobs
+            WHERE type = 'motion' AND created_at >= ? AND json_extract(payload, '$.path') = ?
+            LIMIT 1
+        ''', (since, path)).fetchone()
+
+        return row is not None
+
+    # paths of the clips which are yet to be processed
+    def pending_paths(self):
+        rows = self.connect().execute('''
+            SELECT payload FROM clip_jobs WHERE status IN (?, ?)
+        ''', (JobStatus.PENDING, JobStatus.RUNNING)).fetchall()
+
+        paths = set()
+        for (payload,) in rows:
+            message = json.loads(payload)
+            for key in ('path', 'poster_path'):
+                if message.get(key):
+                    paths.add(os.path.realpath(message[key]))
+                    # avi clips are transcoded to mp4 while they are processed
+                    paths.add(os.path.realpath(message[key].rsplit('.', 1)[0] + '.mp4'))
+
+        return paths
+
+    # called when the processor starts, any job still running was interrupted
+    def recover(self):
+        connection = self.connect()
+        resumed = connection.execute('''
+            UPDATE clip_jobs SET status = ?, updated_at = ? WHERE status = ?
+        ''', (JobStatus.PENDING, time(), JobStatus.RUNNING)).rowcount
+
+        connection.execute('''
+            DELETE FROM clip_jobs WHERE status = ? AND updated_at < ?
+        ''', (JobStatus.DONE, time() - config.VP_JOB_RETENTION_S))
+
+        counts = dict(connection.execute('SELECT status, COUNT(*) FROM clip_jobs GROUP BY status').fetchall())
+        config.logger.info('resumed %d interrupted jobs, %d pending, %d failed' % (
+            resumed, counts.get(JobStatus.PENDING, 0), counts.get(JobStatus.FAILED, 0)))
@@ -0,0 +1,38 @@
+from time import perf_counter, process_time
+import numpy as np
+import sys
+
+from .amg8833_i2c import AMG8833
+from .smbus_mock import MockSMBus
+
+# Compares reading a frame one pixel word at a time with block reads, against a
+# mock bus which simulates i2c transfer time
+
+def benchmark(read, bus, frames):
+    transactions = bus.transactions
+    started_at = perf_counter()
+    cpu_started_at = process_time()
+
+    for _ in range(frames):
+        error, temps = read()
+        assert not error
+
+    elapsed = perf_counter() - started_at
+    cpu = process_time() - cpu_started_at
+
+    return elapsed / frames, cpu / frames, (bus.transactions - transactions) / frames, temps
+
+if __name__ == '__main__':
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    bus = MockSMBus()
+    expected = np.random.uniform(-10.0, 40.0, (8, 8))
+    bus.set_pixels(expected)
+
+    sensor = AMG8833(i2c_interface=bus)
+
+    print('%-12s %12s %12s %14s %8s' % ('read', 'ms/frame', 'cpu ms', 'transactions', 'max fps'))
+    for name, read in [('by word', sensor.read_temp_by_word), ('block', sensor.read_temp)]:
+        per_frame, cpu, transactions, temps = benchmark(read, bus, frames)
+        assert np.allclose(temps, np.round(expected / 0.25) * 0.25)
+        print('%-12s %12.2f %12.3f %14d %8.0f' % (name, per_frame * 1000, cpu * 1000, transactions, 1 / per_frame))
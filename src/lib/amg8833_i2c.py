@@ -10,10 +10,13 @@
 import sys
 
 if 'darwin' in sys.platform:
-    from .amg8833_i2c_mock import AMG8833
+    from .amg8833_i2c_mock import AMG8833, GE_INTC_DIF, GE_INTC_ABS
 else:
 
-    import smbus # i2c bus
+    try:
+        import smbus # i2c bus
+    except ImportError:
+        smbus = None # only a mock bus can be used, see smbus_mock.py
     import numpy as np
     #
     #############################
@@ -52,6 +55,8 @@ else:
     GE_INT7_REG              = 0x17 #///< Pixel 57->64 Interrupt Result
 
     GE_PIXEL_BASE            = 0x80 #///< Pixel 1 Output Value (Lower Level)
+    GE_PIXEL_NUM             = 64
+    I2C_BLOCK_MAX            = 32   #///< Max bytes per SMBus block transfer
     #
     #############################
     # Base Write Registers
@@ -69,10 +74,13 @@ else:
     GE_FPSC_1FPS                   = 0x01
     GE_FPSC_10FPS                  = 0x00
     # GE_INT_CTL_REG - Interrupt Settings
-    GE_INTC_ABS                    = 0b00000001
-    GE_INTC_DIF                    = 0b00000011
+    # bit 0 (INTEN) enables the INT pin, bit 1 (INTMOD) selects absolute value mode,
+    # otherwise pixels are flagged by their change since the previous frame
+    GE_INTC_ABS                    = 0b00000011
+    GE_INTC_DIF                    = 0b00000001
     GE_INTC_OFF                    = 0b00000000
     # GE_STAT_REG - Overflow/Interrupt Settings
+    GE_STAT_INTF                  = 0b00000010
     GE_SCLR_CLR                   = 0b00000110
     #
     ##################################
@@ -86,24 +94,36 @@ else:
     class i2c_driver(object):
         def __init__(self, address, busnum, i2c_interface=None):
             self._address = address
-            # specify smbus for RPi (smbus 1 for RPi 2,3,4)
-            self._bus = smbus.SMBus(busnum)
+            # specify smbus for RPi (smbus 1 for RPi 2,3,4), or use the given bus (eg. a mock)
+            self._bus = i2c_interface if i2c_interface is not None else smbus.SMBus(busnum)
 
         def write8(self, register, value):
             # write 8-bits to specified register
             value = value & 0xFF
             self._bus.write_byte_data(self._address, register, value)
 
+        def read8(self, register):
+            # read 8-bits from specified register
+            return self._bus.read_byte_data(self._address, register) & 0xFF
+
         def read16(self, register, little_endian=True):
             # read 16-bits from specified register
             result = self._bus.read_word_data(self._address,register) & 0xFFFF
             if not little_endian:
                 result = ((result << 8) & 0xFF00) + (result >> 8)
             return result
+
+        def read_block(self, register, length):
+            # read consecutive registers in as few block transfers as possible
+            data = bytearray()
+            while len(data) < length:
+                chunk = min(I2C_BLOCK_MAX, length - len(data))
+                data += bytes(self._bus.read_i2c_block_data(self._address, register + len(data), chunk))
+            return bytes(data)
         
     class AMG8833(object):
-        def __init__(self,addr=GE_I2C_ADDRESS,bus_num=RPI_BUS):
-            self.device=get_i2c_device(addr,bus_num)
+        def __init__(self,addr=GE_I2C_ADDRESS,bus_num=RPI_BUS,i2c_interface=None):
+            self.device=get_i2c_device(addr,bus_num,i2c_interface)
 
             self.set_sensor_mode(GE_PCTL_NORMAL_MODE) # set sensor mode
             self.reset_flags(GE_RST_INITIAL_RST) # reset at startup
@@ -124,9 +144,42 @@ else:
             
         def clear_status(self,value):
             self.device.write8(GE_SCLR_REG,value) # overflows
+
+        def configure_interrupt(self,upper_c,lower_c,hysteresis_c,mode=GE_INTC_DIF):
+            # thresholds are 12-bit two's complement values in 0.25C units
+            for reg,value in [(GE_INTHL_REG,upper_c),(GE_INTLL_REG,lower_c),(GE_IHYSL_REG,hysteresis_c)]:
+                raw = int(round(value / 0.25)) & 0xFFF
+                self.device.write8(reg,raw & 0xFF) # lower level
+                self.device.write8(reg + 1,raw >> 8) # upper level
+            self.clear_interrupt()
+            self.set_interrupt_mode(mode)
+
+        def read_status(self):
+            return self.device.read8(GE_STAT_REG) # overflow/interrupt flags
+
+        def interrupt_flagged(self):
+            return bool(self.read_status() & GE_STAT_INTF)
+
+        def clear_interrupt(self):
+            self.clear_status(GE_SCLR_CLR)
+
+        def read_interrupt_table(self):
+            # 8 bytes, one bit per pixel (pixel 1 is bit 0 of GE_INT0_REG)
+            raw = np.frombuffer(self.device.read_block(GE_INT0_REG, 8), dtype='uint8')
+            return np.unpackbits(raw, bitorder='little').reshape((8,8)).astype('bool')
             
         def read_temp(self):
-            PIXEL_NUM = 64
+            # 128 bytes of pixel registers in 4 block transfers, decoded in one go
+            raw = np.frombuffer(self.device.read_block(GE_PIXEL_BASE, GE_PIXEL_NUM * 2), dtype='<u2')
+            T_arr = self.twos_compl_array(raw) * 0.25
+            if np.any(T_arr < -20) or np.any(T_arr > 100):
+                return True,T_arr # return error if outside temp window
+            T_arr = T_arr.reshape((8,8))
+            return False,T_arr
+
+        def read_temp_by_word(self):
+            # one transaction per pixel, for buses without i2c block reads
+            PIXEL_NUM = GE_PIXEL_NUM
             T_arr = np.zeros((PIXEL_NUM, ), dtype='float32')
             status = False # status boolean for errors
             for i in range(0, PIXEL_NUM):
@@ -142,6 +195,9 @@ else:
             raw = self.device.read16(GE_TTHL_REG) # read thermistor (background temp)
             return self.signed_conv(raw)*0.0625 # scaling values 0.0625
         
+        def twos_compl_array(self, raw): # conversion for pixels, sign extends the 12-bit values
+            return ((raw.astype('uint16') << 4).view('int16') >> 4).astype('float32')
+
         def twos_compl(self, val): # conversion for pixels
             if  0x7FF & val == val:
                 return float(val)
@@ -1,8 +1,23 @@
 import numpy as np
 
+GE_INTC_ABS = 0b00000011
+GE_INTC_DIF = 0b00000001
+
 class AMG8833:
     def __init__(self, **kwargs):
         pass
 
     def read_temp(self):
-        return False, np.random.uniform(0.0, 20.0, (8,8))
\ No newline at end of file
+        return False, np.random.uniform(0.0, 20.0, (8,8))
+
+    def configure_interrupt(self, upper_c, lower_c, hysteresis_c, mode=None):
+        pass
+
+    def interrupt_flagged(self):
+        return True
+
+    def clear_interrupt(self):
+        pass
+
+    def read_interrupt_table(self):
+        return np.ones((8,8), dtype='bool')
\ No newline at end of file
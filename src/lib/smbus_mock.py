@@ -0,0 +1,91 @@
+from time import sleep
+import numpy as np
+
+# In-memory stand-in for smbus.SMBus backed by a 256 byte register map, so the
+# AMG8833 driver can be exercised and benchmarked without the sensor. Each
+# transaction optionally sleeps for a fixed overhead plus a per byte cost to
+# approximate a 400kHz bus (~9 bit times per byte). Setting pixels evaluates the
+# sensor's interrupt function against the configured thresholds.
+class MockSMBus:
+    INT_CTL_REG = 0x03
+    STAT_REG = 0x04
+    SCLR_REG = 0x05
+    INTH_REG = 0x08
+    INTL_REG = 0x0A
+    INT0_REG = 0x10
+    PIXEL_BASE = 0x80
+
+    def __init__(self, transaction_s=0.0002, byte_s=0.0000225):
+        self.registers = bytearray(256)
+        self.transaction_s = transaction_s
+        self.byte_s = byte_s
+        self.transactions = 0
+        self.prev_temps = None
+
+    def set_pixels(self, temps):
+        temps = np.round(np.asarray(temps, dtype='float32').reshape(-1) / 0.25) * 0.25
+
+        # encode temperatures as 12-bit two's complement in 0.25C units
+        raw = (temps / 0.25).astype('int16') & 0xFFF
+        self.registers[self.PIXEL_BASE:self.PIXEL_BASE + 128] = raw.astype('<u2').tobytes()
+
+        self.update_interrupts(temps)
+        self.prev_temps = temps
+
+    def update_interrupts(self, temps):
+        mode = self.registers[self.INT_CTL_REG]
+        if not mode & 0b01:
+            return
+
+        upper = self.read_threshold(self.INTH_REG)
+        lower = self.read_threshold(self.INTL_REG)
+
+        if mode & 0b10:
+            # absolute value mode
+            flagged = (temps > upper) | (temps < lower)
+        elif self.prev_temps is not None:
+            # difference mode, change since the previous frame
+            change = temps - self.prev_temps
+            flagged = (change > upper) | (change < lower)
+        else:
+            flagged = np.zeros(temps.shape, dtype='bool')
+
+        self.registers[self.INT0_REG:self.INT0_REG + 8] = np.packbits(flagged, bitorder='little').tobytes()
+        if np.any(flagged):
+            self.registers[self.STAT_REG] |= 0b10
+
+    def read_threshold(self, register):
+        raw = self.registers[register] | (self.registers[register + 1] << 8)
+        if raw & 0x800:
+            raw -= 4096
+        return raw * 0.25
+
+    def write_byte_data(self, addr, register, value):
+        self.transfer(1)
+
+        if register == self.SCLR_REG:
+            # clear register, resets the flagged status bits
+            self.registers[self.STAT_REG] &= ~value & 0xFF
+            return
+
+        self.registers[register] = value & 0xFF
+
+    def read_byte_data(self, addr, register):
+        self.transfer(1)
+        return self.registers[register]
+
+    def read_word_data(self, addr, register):
+        self.transfer(2)
+        return self.registers[register] | (self.registers[register + 1] << 8)
+
+    def read_i2c_block_data(self, addr, register, length=32):
+        if length > 32:
+            raise OSError('i2c block transfers are limited to 32 bytes')
+
+        self.transfer(length)
+        return list(self.registers[register:register + length])
+
+    def transfer(self, length):
+        self.transactions += 1
+        if self.transaction_s or self.byte_s:
+            sleep(self.transaction_s + self.byte_s * length)
@@ -1,4 +1,4 @@
-from multiprocessing import Process, Queue, Value, Manager
+from multiprocessing import Process, Value, Manager, Event
 from time import sleep
 import signal
 import sys
@@ -10,6 +10,8 @@ from .config import config, State
 from .recorder import start_recorder
 from .thermal_recorder import start_thermal_recorder
 from .processor import video_processor
+from .job_queue import JobQueue
+from .retention import retention_service
 from .temp_monitor import temp_monitor
 from .fan_controller import fan_controller
 from .auto_updater import auto_updater
@@ -21,14 +23,18 @@ def start():
     manager = Manager()
     state = Value('i', State.ALIVE)
     shared = manager.dict()
-    video_queue = Queue()
+    # clips are kept on disk until processed, see job_queue.py
+    video_queue = JobQueue(config.VP_JOB_QUEUE_PATH, Event())
+    thermal_motion = Event()
 
     procs = []
 
-    procs.append(keep_alive('motion detection recorder', state, start_recorder, (video_queue, shared)))
+    procs.append(keep_alive('motion detection recorder', state, start_recorder, (video_queue, shared, thermal_motion)))
     if config.TC_ENABLED:
-        procs.append(keep_alive('thermal camera recorder', state, start_thermal_recorder, (video_queue, shared)))
+        procs.append(keep_alive('thermal camera recorder', state, start_thermal_recorder, (video_queue, shared, thermal_motion)))
     procs.append(keep_alive('video processor', state, video_processor, (video_queue, shared)))
+    if config.RT_ENABLED:
+        procs.append(keep_alive('retention', state, retention_service, (video_queue, shared)))
     procs.append(keep_alive('temp monitor', state, temp_monitor, (shared,)))
     procs.append(keep_alive('fan controller', state, fan_controller, (shared,)))
     procs.append(keep_alive('auto update', state, auto_updater, (state,)))
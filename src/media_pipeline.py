@@ -0,0 +1,172 @@
+import cv2
+import numpy as np
+import os
+
+from .config import config
+from .ml.preprocess import UniformFrameSampler, SAMPLER_CAPACITY, to_model_frame
+from .video_writer import FfmpegVideoWriter
+from .instrumentation import timed
+
+# frames are scored for the poster at this width, keeping the cost per frame small
+POSTER_SCORE_WIDTH = 160
+
+class ClipMedia:
+    def __init__(self, video_path, model_input, frame_indices, spawns, decodes, legacy_spawns, legacy_decodes):
+        self.video_path = video_path
+        self.model_input = model_input
+        # position of each model frame in the clip
+        self.frame_indices = frame_indices
+        self.spawns = spawns
+        self.decodes = decodes
+        # what converting and preprocessing separately would cost
+        self.legacy_spawns = legacy_spawns
+        self.legacy_decodes = legacy_decodes
+
+    @property
+    def spawns_saved(self):
+        return self.legacy_spawns - self.spawns
+
+    @property
+    def decodes_saved(self):
+        return self.legacy_decodes - self.decodes
+
+# Picks the poster rather than using a fixed frame, which is often the empty doorway
+# or motion blur. Each frame is scored by its sharpness (variance of the laplacian)
+# weighted by how much of it differs from the first frame, which is the doorway
+# before the motion started.
+class PosterPicker:
+    def __init__(self):
+        self.index = 0
+        self.background = None
+        self.frame = None
+        self.best_index = None
+        self.score = -1
+
+    def push(self, frame):
+        index = self.index
+        self.index += 1
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if gray.shape[1] > POSTER_SCORE_WIDTH:
+            height = round(gray.shape[0] * POSTER_SCORE_WIDTH / gray.shape[1])
+            gray = cv2.resize(gray, (POSTER_SCORE_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+        if self.background is None:
+            self.background = gray
+
+        sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+        presence = cv2.absdiff(gray, self.background).mean() / 255
+        score = sharpness * (presence + config.VP_POSTER_PRESENCE_FLOOR)
+
+        if score > self.score:
+            self.frame = frame
+            self.best_index = index
+            self.score = score
+
+def poster_path_for(video_path):
+    file_name = os.path.basename(video_path).rsplit('.', 1)[0]
+    return config.VP_FRAMES_DIR + '/frame-' + file_name + '.jpg'
+
+def save_poster(frame, path):
+    return cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, config.VP_POSTER_JPEG_QUALITY])
+
+def pick_model_frame(model_input):
+    picker = PosterPicker()
+    for frame in model_input:
+        picker.push(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    return picker
+
+# poster from rgb24 model frames, used for live windows
+def save_poster_from_model_frames(model_input, path):
+    return save_poster(pick_model_frame(model_input).frame, path)
+
+# Scores the model frames, which are already in memory, and reads only the best one
+# from the clip at full resolution, seeking rather than decoding the whole clip.
+# Falls back to the model frame itself if the clip cannot be read.
+@timed('poster')
+def save_poster_from_clip(video_path, model_input, frame_indices, path):
+    # frames without a position (padding, or dropped by the writer) are not scored
+    positions = [p for p, i in enumerate(frame_indices) if i >= 0]
+    picker = pick_model_frame(model_input[positions])
+    frame_index = frame_indices[positions[picker.best_index]]
+
+    capture = cv2.VideoCapture(video_path)
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        grabbed, frame = capture.read()
+    finally:
+        capture.release()
+
+    if not grabbed:
+        config.logger.warning('could not read frame %d of %s, using the model frame as poster' % (frame_index, video_path))
+        frame = picker.frame
+
+    return save_poster(frame, path)
+
+# Decodes a motion clip once in-process for what the processor needs from it: the
+# mp4 (when the clip is an avi) and the sampled model frames (when the recorder did
+# not provide them). Separately these were up to three ffmpeg/ffprobe runs each
+# decoding the clip again. Returns None if the clip cannot be decoded.
+@timed('decode_media')
+def decode_clip_media(video_path, with_model_input=True):
+    capture = cv2.VideoCapture(video_path)
+
+    if not capture.isOpened():
+        config.logger.warning('could not open %s for decoding' % video_path)
+        return None
+
+    transcode = video_path.endswith('.avi')
+    mp4_path = video_path[:-4] + '.mp4' if transcode else video_path
+    writer = None
+
+    model_frames = np.zeros((SAMPLER_CAPACITY,) + config.VC_INPUT_SHAPE[1:], dtype='uint8') if with_model_input else None
+    sampler = UniformFrameSampler(model_frames) if with_model_input else None
+    frames = 0
+
+    try:
+        while True:
+            grabbed, frame = capture.read()
+            if not grabbed:
+                break
+
+            if transcode:
+                if writer is None:
+                    fps = capture.get(cv2.CAP_PROP_FPS) or config.MD_MOTION_FPS
+                    writer = FfmpegVideoWriter(mp4_path, fps, (frame.shape[1], frame.shape[0]))
+                writer.write(frame)
+
+            if sampler is not None:
+                sampler.push(lambda: to_model_frame(frame))
+
+            frames += 1
+    finally:
+        capture.release()
+
+        if writer is not None:
+            writer.release()
+
+    if frames == 0:
+        config.logger.warning('could not decode %s' % video_path)
+        return None
+
+    # the avi is only removed once the mp4 is in place, otherwise it is kept as the clip
+    if transcode and not writer.failed and os.path.exists(mp4_path):
+        os.remove(video_path)
+    elif transcode:
+        config.logger.warning('could not transcode %s, keeping the avi' % video_path)
+        mp4_path = video_path
+
+    # rgb24 bytes, see load_model_input
+    model_input = sampler.finish().copy() if sampler is not None else None
+
+    return ClipMedia(
+        video_path=mp4_path,
+        model_input=model_input,
+        frame_indices=sampler.picked_indices if sampler is not None else None,
+        spawns=1 if transcode else 0,
+        decodes=1,
+        # ffmpeg transcode, ffprobe frame count + ffmpeg frame extraction
+        legacy_spawns=(1 if transcode else 0) + (2 if with_model_input else 0),
+        legacy_decodes=(1 if transcode else 0) + (1 if with_model_input else 0),
+    )
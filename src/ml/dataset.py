@@ -175,6 +175,22 @@ class VideoDataSequence(tf.keras.utils.Sequence):
             
         return one_hot_class
         
+# the split is seeded so the test clips stay held out from training, see
+# check_quantized_parity
+def split_dataset(labelled_vids):
+    SEED = 1
+    labelled_vids = list(labelled_vids)
+    random.Random(SEED).shuffle(labelled_vids)
+
+    val_amt = math.floor(len(labelled_vids) * VAL_PORTION)
+    test_amt = math.floor(len(labelled_vids) * TEST_PORTION)
+
+    val_vids = labelled_vids[:val_amt]
+    test_vids = labelled_vids[val_amt:val_amt+test_amt]
+    train_vids = labelled_vids[val_amt+test_amt:]
+
+    return train_vids, val_vids, test_vids
+
 def load_dataset(json_path):
     print('loading dataset from %s' % json_path)
     labelled_vids = json.load(open(json_path, 'r'))
@@ -194,15 +210,7 @@ def load_dataset(json_path):
     pp = pprint.PrettyPrinter()
     pp.pprint(summary)
 
-    SEED = 1
-    random.Random(SEED).shuffle(labelled_vids)
-
-    val_amt = math.floor(len(labelled_vids) * VAL_PORTION)
-    test_amt = math.floor(len(labelled_vids) * TEST_PORTION)
-
-    val_vids = labelled_vids[:val_amt]
-    test_vids = labelled_vids[val_amt:val_amt+test_amt]
-    train_vids = labelled_vids[val_amt+test_amt:]
+    train_vids, val_vids, test_vids = split_dataset(labelled_vids)
 
     print('train amt: ', len(train_vids))
     print('val amt: ', len(val_vids))
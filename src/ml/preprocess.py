@@ -2,23 +2,71 @@ import os
 import sys
 import subprocess
 import math
+import cv2
 import numpy as np
 from ..config import config
+from ..instrumentation import timed
 
 MAX_FRAMES = config.VC_INPUT_SHAPE[0]
 FRAME_HEIGHT = config.VC_INPUT_SHAPE[1]
 FRAME_WIDTH = config.VC_INPUT_SHAPE[2]
 CHANNELS = config.VC_INPUT_SHAPE[3]
 MIN_FRAME_INTERVAL = math.floor(config.MD_MOTION_FPS / 3) # extract at most ~3 fps
+SAMPLER_CAPACITY = MAX_FRAMES * 2
 
-def preprocess_video(video_path: str, cache=False, ffmpeg_threads=None):
-    cache_file = get_cache_file_path(video_path)
+# decoder is 'opencv' (in-process, single pass) or 'ffmpeg' (ffprobe then an ffmpeg
+# process), defaulting to VC_PREPROCESS_DECODER
+def preprocess_video(video_path: str, cache=False, ffmpeg_threads=None, decoder=None):
+    decoder = decoder or config.VC_PREPROCESS_DECODER
+    cache_file = get_cache_file_path(video_path, decoder)
 
     if cache and os.path.isfile(cache_file):
         with open(cache_file, 'rb') as file:
             cached_tensor = np.frombuffer(file.read(), dtype='float32')
             return np.reshape(cached_tensor, config.VC_INPUT_SHAPE)
 
+    if decoder == 'opencv':
+        frames_tensor = decode_frames(video_path, ffmpeg_threads).astype('float32') / 255
+    else:
+        frames_tensor = extract_frames(video_path, ffmpeg_threads)
+
+    if cache:
+        os.makedirs(config.VC_PREPROCESS_CACHE_PATH, exist_ok=True)
+        with open(cache_file, 'wb') as file:
+            file.write(frames_tensor.tobytes())
+
+    return frames_tensor
+
+# Decodes the video in-process, scaling only the frames the sampler keeps, so there is
+# no ffprobe run, no dependency on the stream reporting its frame count and the
+# decoded stream is never held in memory. Returns the rgb24 frames.
+@timed('decode_frames')
+def decode_frames(video_path: str, threads=None):
+    # the params overload (and CAP_PROP_N_THREADS) needs a newer opencv than the
+    # pinned 4.4, which only has VideoCapture(path)
+    if threads and hasattr(cv2, 'CAP_PROP_N_THREADS'):
+        capture = cv2.VideoCapture(video_path, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads])
+    else:
+        capture = cv2.VideoCapture(video_path)
+
+    if not capture.isOpened():
+        raise ValueError('could not open %s for decoding' % video_path)
+
+    sampler = UniformFrameSampler(np.zeros((SAMPLER_CAPACITY,) + config.VC_INPUT_SHAPE[1:], dtype='uint8'))
+
+    try:
+        while True:
+            # frames which are not sampled are skipped without being converted
+            if not capture.grab():
+                break
+            sampler.push(lambda: to_model_frame(capture.retrieve()[1]))
+    finally:
+        capture.release()
+
+    return sampler.finish()
+
+# the frames every frame_interval, scaled by ffmpeg
+def extract_frames(video_path: str, ffmpeg_threads=None):
     frames = get_frame_count(video_path, ffmpeg_threads)
     
     frame_interval = max(MIN_FRAME_INTERVAL, 0 if frames <= MAX_FRAMES else math.floor(frames / MAX_FRAMES))
@@ -36,20 +84,111 @@ def preprocess_video(video_path: str, cache=False, ffmpeg_threads=None):
         padding = max_length - len(frames_buffer)
         frames_tensor = np.pad(frames_tensor, (0, padding))
 
-    frames_tensor = np.reshape(frames_tensor, config.VC_INPUT_SHAPE)
-
-    if cache:
-        os.makedirs(config.VC_PREPROCESS_CACHE_PATH, exist_ok=True)
-        with open(cache_file, 'wb') as file:
-            file.write(frames_tensor.tobytes())
-
-    return frames_tensor
-
-def get_cache_file_path(video_path: str) -> str:
+    return np.reshape(frames_tensor, config.VC_INPUT_SHAPE)
+
+# Picks up to MAX_FRAMES uniformly spaced frames from a stream of unknown length using
+# frames_buffer (SAMPLER_CAPACITY frames) as a reservoir. A frame is kept every `interval`
+# frames, when the buffer is full every other kept frame is dropped and the interval
+# doubles, so memory stays fixed. finish() then spreads `picks` (MAX_FRAMES by default)
+# over the kept frames. The index of each kept frame in the stream is tracked, see
+# picked_indices.
+class UniformFrameSampler:
+    def __init__(self, frames_buffer, picks=MAX_FRAMES, interval=MIN_FRAME_INTERVAL):
+        self.frames = frames_buffer
+        self.picks = picks
+        self.indices = np.full(len(frames_buffer), -1, dtype='int64')
+        self.interval = max(1, interval)
+        self.index = 0
+        self.count = 0
+        # stream index of each frame returned by finish(), -1 for padding
+        self.picked_indices = None
+
+    # read_frame is only called if the frame is sampled. stream_index is recorded for
+    # the frame instead of its position in the pushed frames, eg. its index in a video
+    # which skipped some of them.
+    def push(self, read_frame, stream_index=None) -> bool:
+        index = self.index
+        self.index += 1
+
+        if index % self.interval != 0:
+            return False
+
+        if self.count == len(self.frames):
+            kept = self.frames[0::2]
+            self.frames[:len(kept)] = kept.copy()
+            kept_indices = self.indices[0::2]
+            self.indices[:len(kept_indices)] = kept_indices.copy()
+            self.count = len(kept)
+            self.interval *= 2
+
+            if index % self.interval != 0:
+                return False
+
+        self.frames[self.count] = read_frame()
+        self.indices[self.count] = index if stream_index is None else stream_index
+        self.count += 1
+
+        return True
+
+    # moves the selected frames to the front of the buffer and zeroes any unused
+    # frames, matching the padding of preprocess_video
+    def finish(self):
+        if self.count > self.picks:
+            picks = np.linspace(0, self.count - 1, self.picks).round().astype('int')
+            self.frames[:self.picks] = self.frames[picks]
+            self.indices[:self.picks] = self.indices[picks]
+            self.count = self.picks
+
+        self.frames[self.count:self.picks] = 0
+        self.indices[self.count:] = -1
+        self.picked_indices = [int(i) for i in self.indices[:self.picks]]
+
+        return self.frames[:self.picks]
+
+# Keeps the latest MAX_FRAMES frames sampled every MIN_FRAME_INTERVAL frames, used
+# to classify a clip while it is still being recorded
+class RollingFrameWindow:
+    def __init__(self):
+        self.frames = np.zeros(config.VC_INPUT_SHAPE, dtype='uint8')
+        self.index = 0
+        self.count = 0
+
+    # read_frame is only called if the frame is sampled
+    def push(self, read_frame) -> bool:
+        index = self.index
+        self.index += 1
+
+        if index % max(1, MIN_FRAME_INTERVAL) != 0:
+            return False
+
+        self.frames[self.count % MAX_FRAMES] = read_frame()
+        self.count += 1
+
+        return True
+
+    def is_full(self) -> bool:
+        return self.count >= MAX_FRAMES
+
+    # copies the window into out, oldest frame first
+    def copy_to(self, out):
+        start = self.count % MAX_FRAMES
+        out[:MAX_FRAMES - start] = self.frames[start:]
+        out[MAX_FRAMES - start:] = self.frames[:start]
+
+# converts a BGR frame to the model's input size and channel order
+def to_model_frame(frame):
+    frame = cv2.resize(frame, (FRAME_WIDTH, FRAME_HEIGHT), interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+# the decoders' tensors differ slightly, ffmpeg keeps the name cached tensors had
+# before there was a choice of decoder
+def get_cache_file_path(video_path: str, decoder='ffmpeg') -> str:
     file_name = os.path.basename(video_path)
+    prefix = 'preprocessed-' if decoder == 'ffmpeg' else 'preprocessed-' + decoder + '-'
 
-    return os.path.realpath(config.VC_PREPROCESS_CACHE_PATH + '/preprocessed-' + file_name + '.tensor')
+    return os.path.realpath(config.VC_PREPROCESS_CACHE_PATH + '/' + prefix + file_name + '.tensor')
 
+@timed('frame_count')
 def get_frame_count(video_path: str, threads) -> int:
     proc = subprocess.run([
             'ffprobe',
@@ -68,8 +207,11 @@ def get_frame_count(video_path: str, threads) -> int:
         stdout=subprocess.PIPE
     )
 
-    return int(proc.stdout.decode('utf8'))
+    # streams which do not report it print N/A, every MIN_FRAME_INTERVAL frame is read
+    frames = proc.stdout.decode('utf8').strip()
+    return int(frames) if frames.isdigit() else 0
 
+@timed('read_frames')
 def read_frames(video_path: str, frame_interval: int, frame_dims, threads) -> bytes:
     proc = subprocess.run([
             'ffmpeg',
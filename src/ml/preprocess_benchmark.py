@@ -0,0 +1,86 @@
+from ..config import config
+from ..video_writer import FfmpegVideoWriter
+from .preprocess import preprocess_video
+
+from time import perf_counter
+import tempfile
+import resource
+import cv2
+import numpy as np
+import os
+import sys
+
+CLIP_LENGTHS_S = [5, 15, 30, 60]
+REPEATS = 3
+
+# cpu time of this process and of the ffmpeg/ffprobe processes it waited for
+def cpu_time():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+# a clip of moving noise at the recorder's resolution and frame rate
+def write_clip(path, length_s):
+    width, height = config.MD_RESOLUTION
+    writer = FfmpegVideoWriter(path, config.MD_MOTION_FPS, (width, height))
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 255, (height, width, 3), dtype='uint8')
+
+    for i in range(int(length_s * config.MD_MOTION_FPS)):
+        frame = np.roll(background, i * 4, axis=1)
+        cv2.putText(frame, str(i), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        writer.write(frame)
+
+    writer.release()
+
+# Runs both preprocess_video decoders over each clip and reports wall and cpu time
+# (including the ffmpeg and ffprobe processes) and how far apart their tensors are.
+# A decoder whose tools are not installed is skipped, the diff is then unknown.
+def benchmark_preprocess(paths, threads=1):
+    print('%-28s %-8s %10s %10s %12s' % ('clip', 'decoder', 'wall ms', 'cpu ms', 'mean diff'))
+    skipped = set()
+
+    for path in paths:
+        outputs = {}
+
+        for decoder in ['ffmpeg', 'opencv']:
+            if decoder in skipped:
+                continue
+
+            walls = []
+            cpus = []
+
+            try:
+                for _ in range(REPEATS):
+                    cpu_started_at = cpu_time()
+                    started_at = perf_counter()
+                    outputs[decoder] = preprocess_video(path, ffmpeg_threads=threads, decoder=decoder)
+                    walls.append(perf_counter() - started_at)
+                    cpus.append(cpu_time() - cpu_started_at)
+            except FileNotFoundError as e:
+                print('skipping the %s decoder, %s is not installed' % (decoder, e.filename))
+                skipped.add(decoder)
+                continue
+
+            diff = float(np.abs(outputs[decoder] - outputs['ffmpeg']).mean()) if 'ffmpeg' in outputs else float('nan')
+            print('%-28s %-8s %10.1f %10.1f %12.4f' % (os.path.basename(path), decoder, np.median(walls) * 1000, np.median(cpus) * 1000, diff))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        benchmark_preprocess(sys.argv[1:])
+        sys.exit(0)
+
+    out_dir = tempfile.mkdtemp()
+    paths = []
+
+    for length_s in CLIP_LENGTHS_S:
+        path = '%s/clip-%ds.mp4' % (out_dir, length_s)
+        write_clip(path, length_s)
+        paths.append(path)
+
+    try:
+        benchmark_preprocess(paths)
+    finally:
+        for path in paths:
+            os.remove(path)
+        os.rmdir(out_dir)
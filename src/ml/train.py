@@ -17,6 +17,7 @@ if len(sys.argv) < 3:
 
 EPOCHS = 40
 LEARNING_RATE = 1e-4
+QUANTIZATION_SAMPLES = 200
 
 def train_model(dataset):
     print('loading model')
@@ -32,7 +33,7 @@ def train_model(dataset):
 
     return model
 
-def save_model(model, path):
+def save_model(model, path, dataset):
     print('saving model to %s' % path)
 
     os.makedirs(path, exist_ok=True)
@@ -47,8 +48,40 @@ def save_model(model, path):
     with open(path + '/model.tflite', 'wb') as f:
         f.write(tflite_model)
 
+    save_quantized_model(unbatched_model, path, dataset['train'].labelled_vids)
+
+# Full integer post-training quantization, calibrated on clips from the training
+# set. They are preprocessed through the cache, which rebuilds any entries retention
+# has evicted. The input is uint8 so the processor can feed the decoded rgb24 frames
+# without converting them to float.
+def save_quantized_model(unbatched_model, path, labelled_vids):
+    videos = [item['video'] for item in labelled_vids if os.path.isfile(item['video'])]
+
+    if not videos:
+        print('no training clips on disk, skipping quantized model')
+        return
+
+    random.shuffle(videos)
+
+    def representative_dataset():
+        for video in videos[:QUANTIZATION_SAMPLES]:
+            tensor = preprocess_video(video, cache=True)
+            yield [np.reshape(tensor, (1,) + config.VC_INPUT_SHAPE)]
+
+    print('creating int8 tflite model from %d representative clips' % min(len(videos), QUANTIZATION_SAMPLES))
+    converter = tf.lite.TFLiteConverter.from_keras_model(unbatched_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+    tflite_model = converter.convert()
+
+    with open(path + '/model.int8.tflite', 'wb') as f:
+        f.write(tflite_model)
+
 if __name__ == '__main__':
     dataset = load_dataset(sys.argv[1])
     model = train_model(dataset)
-    save_model(model, sys.argv[2])
+    save_model(model, sys.argv[2], dataset)
     print('done')
\ No newline at end of file
@@ -1,6 +1,8 @@
-import tflite_runtime.interpreter as tflite
 import numpy as np
-from multiprocessing import Queue
+from queue import PriorityQueue, SimpleQueue, Empty
+import threading
+import heapq
+from time import monotonic
 import subprocess
 import os
 import uuid
@@ -9,85 +11,524 @@ from datetime import datetime, timezone
 
 from .config import config
 from .ml.preprocess import preprocess_video
+from .frame_buffer import SharedFrames
+from .renditions import generate_renditions
+from .media_pipeline import decode_clip_media, poster_path_for, save_poster_from_clip, save_poster_from_model_frames
+from .job_queue import JobQueue, JobStatus, JOB_PRIORITIES
+from .inference_engine import load_inference_engine
+from .instrumentation import stage, timed, export as export_stages
 from .ml.class_map import class_map
 from . import db
 
+# Clips are claimed in batches from the durable job queue (see job_queue.py) and
+# processed by a pool of VP_WORKERS threads sharing one batching inference engine.
+# Workers only read from the db, each job returns a commit function which is run on this thread
+# in the order the claimed clips were captured (the queue claims by priority, so a live
+# window can be claimed before an earlier clip). Renditions only touch an existing event
+# and are committed as soon as they are ready.
 def video_processor(queue, shared):
-    model = load_tflite_model()
+    model = load_inference_engine()
     dbcon = db.connect()
 
     os.makedirs(config.VP_FRAMES_DIR, exist_ok=True)
     os.makedirs(config.VP_PUBLIC_DIR, exist_ok=True)
 
-    while True:
-        video = queue.get(block=True)
-        config.logger.info('received video %s for processing' % video)
-
-        if video['path'].endswith('.avi'):
-            config.logger.info('converting avi to mp4')
-            video['path'] = convert_video_to_mp4(video['path'])
-
-        if video['type'] != 'motion':
-            config.logger.info('video type is %s, not processing' % video['type'])
-            continue
+    # jobs left running by a previous processor are resumed
+    queue.recover()
+
+    jobs = PriorityQueue()
+    results = SimpleQueue()
+    # commit order keys of the claimed jobs which write to the db
+    ordered = SimpleQueue()
+    # bounds the jobs claimed from the queue but not yet processed
+    slots = threading.Semaphore(config.VP_JOB_CLAIM_BATCH)
+
+    def receive_clips():
+        received = 0
+
+        while True:
+            slots.acquire()
+            limit = 1
+            while limit < config.VP_JOB_CLAIM_BATCH and slots.acquire(blocking=False):
+                limit += 1
+
+            claimed = queue.wait_and_claim(limit)
+            for _ in range(limit - len(claimed)):
+                slots.release()
+
+            for job_id, video in claimed:
+                config.logger.info('received video %s for processing' % video)
+
+                # only jobs which write to the db take part in the commit order, it is
+                # registered before the job can finish
+                order_key = None
+                if video['type'] in ('motion', 'motion_window'):
+                    order_key = (video.get('started_at', video['queued_at']), job_id)
+                    ordered.put(order_key)
+
+                jobs.put((JOB_PRIORITIES.get(video['type'], len(JOB_PRIORITIES)), received, order_key, job_id, video))
+                received += 1
+
+            shared['vp_queued_jobs'] = jobs.qsize()
+
+    def process_jobs():
+        worker_dbcon = db.connect()
+
+        while True:
+            _, _, order_key, job_id, video = jobs.get()
+            commit = None
+
+            try:
+                if video['type'] == 'motion_window':
+                    commit = process_live_window(video, model, worker_dbcon, queue)
+                elif video['type'] == 'motion':
+                    commit = process_motion_clip(video, model, worker_dbcon, queue, job_id)
+                elif video['type'] == 'renditions':
+                    commit = process_renditions(video)
+                else:
+                    process_other_clip(video)
+
+                if commit is None:
+                    queue.complete(job_id)
+            except Exception as e:
+                config.logger.warning('failed to process %s' % video['path'], exc_info=e)
+                fail_job(job_id, video, e)
+
+            slots.release()
+
+            if order_key is not None or commit is not None:
+                results.put((order_key, job_id, video, commit))
+
+    # Jobs which will not be retried give up the recorder's frames. Never raises, a
+    # worker which died here would never post its result and hold up every later
+    # commit, the job is left running and is retried when the processor restarts.
+    def fail_job(job_id, video, error):
+        try:
+            if queue.fail(job_id, error) == JobStatus.FAILED:
+                release_model_frames(video)
+        except Exception as e:
+            config.logger.error('could not record the failure of job %d' % job_id, exc_info=e)
+
+    threading.Thread(target=receive_clips, name='clip receiver', daemon=True).start()
+    for i in range(config.VP_WORKERS):
+        threading.Thread(target=process_jobs, name='video worker %d' % i, daemon=True).start()
+
+    def run_commit(job_id, video, commit):
+        try:
+            with stage('db_commit'):
+                commit(dbcon, shared)
+            queue.complete(job_id)
+        except Exception as e:
+            config.logger.warning('failed to commit processed clip', exc_info=e)
+            fail_job(job_id, video, e)
+
+    # finished jobs waiting for every earlier captured job claimed before them
+    pending = {}
+    waiting = []
 
-        pet, event = classify_video(video['path'], model)
+    while True:
+        order_key, job_id, video, commit = results.get()
+
+        while True:
+            try:
+                heapq.heappush(waiting, ordered.get_nowait())
+            except Empty:
+                break
+
+        if order_key is None:
+            run_commit(job_id, video, commit)
+        else:
+            pending[order_key] = (job_id, video, commit)
+
+        while waiting and waiting[0] in pending:
+            job_id, video, commit = pending.pop(heapq.heappop(waiting))
+
+            if commit is not None:
+                run_commit(job_id, video, commit)
+
+        shared['vp_queued_jobs'] = jobs.qsize()
+        export_stages(shared)
+
+# when the clip was recorded, a backlog drained after a restart is processed long
+# after that. Messages queued before started_at was sent fall back to the time the
+# job was queued.
+def captured_at(video):
+    return datetime.fromtimestamp(video.get('started_at', video['queued_at']), tz=timezone.utc)
+
+# the ffmpeg and decoding threads of each worker, inference has its own
+# VP_INFERENCE_THREADS
+def worker_threads():
+    return max(1, config.VP_FFMPEG_THREADS // config.VP_WORKERS)
+
+def process_other_clip(video):
+    if video['path'].endswith('.avi'):
+        config.logger.info('converting avi to mp4')
+        video['path'] = convert_video_to_mp4(video['path'])
+
+    config.logger.info('video type is %s, not processing' % video['type'])
+
+# classifies a finished motion clip and returns the function committing its event
+# Steps which cannot be repeated (using up the recorder's frames, replacing the avi)
+# are written back to the job so a retry starts from where this attempt got to
+def process_motion_clip(video, model, dbcon, queue, job_id):
+    # the path the clip was recorded at identifies its event, even once transcoded
+    clip = video.setdefault('clip', video['path'])
+
+    # thermal clips are read from the job table whether or not they have been
+    # processed yet, the queue orders them after the motion clips they inform
+    thermal_clips = queue.thermal_clips_since(video['started_at'] - config.VP_THERMAL_MATCH_SLACK_S) if 'started_at' in video else []
+
+    # an event may have already been created while the clip was recording
+    provisional_event = db.select_event_by_clip(dbcon, clip)
+    thermal = match_thermal_clip(video, thermal_clips)
+
+    # the live window identified the pet and the crossing is unambiguous
+    skip_inference = bool(provisional_event and thermal and thermal['direction_confidence'] >= config.VP_THERMAL_SKIP_CONFIDENCE)
+
+    # clips the cascade is confident contain no animal skip the model altogether, in
+    # 'record' mode the decision is only logged and compared with the model's
+    evaluated = config.VP_CASCADE_MODE in ('record', 'enforce') and not skip_inference and not provisional_event
+    would_reject = False
+    if evaluated:
+        confidence = cascade_no_animal_confidence(video, thermal_clips)
+        would_reject = confidence >= config.VP_CASCADE_CONFIDENCE
+
+        if would_reject:
+            config.logger.info('cascade %s %s (no animal, confidence %.2f)' % (
+                'rejected' if config.VP_CASCADE_MODE == 'enforce' else 'would reject', clip, confidence))
+
+    rejected = would_reject and config.VP_CASCADE_MODE == 'enforce'
+
+    # the recorder's frames are taken even when inference is skipped, which releases
+    # their block, they are used to pick the poster
+    if rejected:
+        release_model_frames(video)
+        model_input = None
+    else:
+        started_at = monotonic()
+        model_input = load_model_input(video)
+
+    frame_indices = video.get('frame_indices') if model_input is not None else None
+
+    if 'frames' in video:
+        del video['frames']
+        queue.update(job_id, video)
+
+    # without the recorder's frames the clip is decoded once for them, transcoding an
+    # avi in the same pass. Both scale frames in-process, which only replaces the
+    # training preprocessing once it has been checked, see VC_USE_RECORDER_FRAMES.
+    media = None
+    if not rejected and not skip_inference and model_input is None and config.VC_USE_RECORDER_FRAMES:
+        media = decode_clip_media(video['path'])
+
+    if media:
+        video['path'] = media.video_path
+        model_input = media.model_input
+        frame_indices = media.frame_indices
+
+    if video['path'] != clip:
+        queue.update(job_id, video)
+
+    if rejected:
+        pet, event = None, None
+    elif skip_inference:
+        config.logger.info('using thermal direction %d for %s, skipping inference' % (thermal['direction'], clip))
+        pet, event = provisional_event['pets'][0], thermal['direction']
+    else:
+        classify_input = model_input if config.VC_USE_RECORDER_FRAMES else None
+        pet, event = classify_video(video['path'], model, classify_input, thermal_prior(thermal))
+        cascade_stats.record_inference(monotonic() - started_at)
+
+    if evaluated:
+        cascade_stats.record(would_reject, rejected, kept=bool(pet and event))
+
+    # only clips kept as an event need an mp4 and a poster
+    if pet and event and video['path'].endswith('.avi'):
+        config.logger.info('converting avi to mp4')
+        video['path'] = convert_video_to_mp4(video['path'])
+        queue.update(job_id, video)
+
+    if pet and event:
+        frame_file_path = poster_path_for(video['path'])
+
+        if model_input is not None and model_input.dtype == np.uint8 and frame_indices and max(frame_indices) >= 0:
+            save_poster_from_clip(video['path'], model_input, frame_indices, frame_file_path)
+        else:
+            frame_file_path = generate_video_frame(video['path'])
+
+    def commit(dbcon, shared):
+        if media:
+            report_media_savings(shared, video['path'], media)
+        cascade_stats.report(shared)
+
+        # a live window may have been committed since the clip was classified
+        provisional_event = db.select_event_by_clip(dbcon, clip)
+        if provisional_event:
+            unlink_pub_file(provisional_event['frame_file_name'])
+            unlink_renditions(provisional_event['renditions'])
 
         if not pet or not event:
             config.logger.info('video classified as DISCARD, ignoring...')
-            continue
-
-        video_file_name = link_to_pub_dir(video['path'])
-        frame_file_path = generate_video_frame(video['path'])
-        frame_file_name = link_to_pub_dir(frame_file_path)
+            if provisional_event:
+                config.logger.info('revoking provisional event for %s' % clip)
+                db.delete_event(dbcon, provisional_event['id'])
+            return
 
-        db.insert_event(dbcon, {
-            'timestamp': datetime.utcnow().replace(tzinfo=timezone.utc),
+        pet_door_event = {
+            'timestamp': captured_at(video),
             'pets': [pet],
             'event': event,
-            'video_file_name': video_file_name,
-            'frame_file_name': frame_file_name
-        })
+            'video_file_name': link_to_pub_dir(video['path']),
+            'frame_file_name': link_to_pub_dir(frame_file_path),
+            'clip': clip,
+            'status': db.EventStatus.CONFIRMED,
+        }
+
+        if provisional_event:
+            config.logger.info('confirming provisional event for %s' % clip)
+            db.update_event(dbcon, provisional_event['id'], pet_door_event)
+        else:
+            db.insert_event(dbcon, pet_door_event)
+
+        if config.VP_RENDITIONS_ENABLED:
+            queue.put({'type': 'renditions', 'path': video['path'], 'poster_path': frame_file_path, 'clip': clip})
 
         config.logger.info('finished processing %s' % video)
 
+    return commit
+
+# classifies the latest frames of a clip which is still recording and creates a
+# provisional event if the model is confident, the event is confirmed or revised
+# once the whole clip has been processed
+def process_live_window(window, model, dbcon, queue):
+    # while a backlog drains the clip has usually finished, its motion job decides
+    if queue.has_motion_job(window['path'], window['queued_at']):
+        config.logger.info('%s has finished recording, dropping its live window' % window['path'])
+        release_model_frames(window)
+        return None
+
+    model_input = load_model_input(window)
+
+    if model_input is None or db.select_event_by_clip(dbcon, window['path']):
+        return None
+
+    prediction = model.predict(model_input)
+    class_prediction = np.argmax(prediction)
+    confidence = prediction[class_prediction]
+
+    if class_map[class_prediction] == 'DISCARD' or confidence < config.VC_LIVE_CONFIDENCE_THRESHOLD:
+        config.logger.info('live window not conclusive (confidence %.2f)' % confidence)
+        return None
+
+    pet, event = class_map[class_prediction]
+    config.logger.info('live window classified as pet %d event %d (confidence %.2f)' % (pet, event, confidence))
+
+    # the best frame of the window stands in until the clip has finished
+    file_name = os.path.basename(window['path']).rsplit('.', 1)[0]
+    frame_file_path = config.VP_FRAMES_DIR + '/live-frame-' + file_name + '.jpg'
+    save_poster_from_model_frames(model_input, frame_file_path)
+
+    def commit(dbcon, shared):
+        if not db.select_event_by_clip(dbcon, window['path']):
+            db.insert_event(dbcon, {
+                'timestamp': captured_at(window),
+                'pets': [pet],
+                'event': event,
+                'video_file_name': None,
+                'frame_file_name': link_to_pub_dir(frame_file_path),
+                'clip': window['path'],
+                'status': db.EventStatus.PROVISIONAL,
+            })
+        os.remove(frame_file_path)
+
+    return commit
+
+# makes the dashboard renditions of a confirmed event's clip, see renditions.py
+def process_renditions(job):
+    renditions = generate_renditions(job['path'], job['poster_path'], threads=worker_threads())
+
+    if renditions is None:
+        return None
+
+    def commit(dbcon, shared):
+        event = db.select_event_by_clip(dbcon, job['clip'])
+
+        if not event or not event['video_file_name']:
+            config.logger.info('event for %s no longer exists, discarding renditions' % job['clip'])
+            renditions.remove()
+            return
+
+        # the job may have run before
+        unlink_renditions(event['renditions'])
+
+        db.update_event_renditions(dbcon, event['id'], {
+            'preview': link_to_pub_dir(renditions.preview_path),
+            'thumbnails': {str(width): link_to_pub_dir(path) for width, path in renditions.thumbnail_paths.items()},
+            'sprite': dict(renditions.sprite, file_name=link_to_pub_dir(renditions.sprite_path)),
+        })
+
+    return commit
+
+def report_media_savings(shared, video_path, media):
+    shared['vp_spawns_saved'] = shared.get('vp_spawns_saved', 0) + media.spawns_saved
+    shared['vp_decodes_saved'] = shared.get('vp_decodes_saved', 0) + media.decodes_saved
+
+    config.logger.info('decoded %s once with %d process spawns, saved %d spawns and %d decodes (%d and %d in total)' % (
+        video_path, media.spawns, media.spawns_saved, media.decodes_saved, shared['vp_spawns_saved'], shared['vp_decodes_saved']))
+
+# returns the avi path unchanged if ffmpeg failed
+@timed('transcode')
 def convert_video_to_mp4(video_path):
     mp4_path = video_path.replace('.avi', '.mp4')
-    os.system('ffmpeg -hide_banner -loglevel error -y -threads %d -i %s -vcodec libx264 -movflags +faststart %s' 
-        % (config.VP_FFMPEG_THREADS, video_path, mp4_path))
+    exit_code = os.system('ffmpeg -hide_banner -loglevel error -y -threads %d -i %s -vcodec libx264 -movflags +faststart %s' 
+        % (worker_threads(), video_path, mp4_path))
+
+    if exit_code != 0 or not os.path.exists(mp4_path):
+        config.logger.warning('could not convert %s to mp4, keeping the avi' % video_path)
+        return video_path
+
     config.logger.info('finished converting video to mp4 at %s' % mp4_path)
     os.remove(video_path)
 
     return mp4_path
 
-def load_tflite_model():
-    config.logger.info('loading tflite model from %s' % config.VP_TFLITE_MODEL_PATH)
-    interpreter = tflite.Interpreter(model_path=config.VP_TFLITE_MODEL_PATH)
-    interpreter.allocate_tensors()
-    config.logger.info('loaded model')
-
-    return interpreter
-
-def classify_video(video_path: str, model):
-    config.logger.info('preprocessing video %s' % video_path)
-    model_input = preprocess_video(video_path, ffmpeg_threads=config.VP_FFMPEG_THREADS)
-    config.logger.info('preprocessed video')
+# the recorder hands the frames block over, it must be unlinked even if unused
+def release_model_frames(video):
+    if 'frames' not in video:
+        return
+
+    try:
+        SharedFrames.attach(video['frames']).release()
+    except FileNotFoundError:
+        pass
+
+# uses the frames sampled by the recorder when available, otherwise decodes the video
+@timed('load_model_input')
+def load_model_input(video):
+    if 'frames' not in video:
+        return None
+
+    try:
+        model_frames = SharedFrames.attach(video['frames'])
+    except FileNotFoundError:
+        config.logger.warning('recorded frames for %s are no longer available' % video['path'])
+        return None
+
+    try:
+        # the sampler leaves the selected frames at the front of the block, they are
+        # kept as rgb24 bytes which the inference engine scales (or feeds as is to
+        # the quantized model)
+        return model_frames.array[:config.VC_INPUT_SHAPE[0]].copy()
+    finally:
+        model_frames.release()
+
+# thermal clips recorded at the same time as the motion clip
+def thermal_clips_during(video, thermal_clips):
+    if 'started_at' not in video:
+        return []
+
+    return [
+        t for t in thermal_clips
+        if t['started_at'] <= video['ended_at'] + config.VP_THERMAL_MATCH_SLACK_S
+        and t['ended_at'] >= video['started_at'] - config.VP_THERMAL_MATCH_SLACK_S
+    ]
+
+# finds the most confident thermal crossing recorded during the motion clip
+def match_thermal_clip(video, thermal_clips):
+    matches = [t for t in thermal_clips_during(video, thermal_clips) if t.get('direction')]
+
+    return max(matches, key=lambda t: t['direction_confidence']) if matches else None
+
+# First stage of the classifier cascade, returns the confidence (0-1) that a clip
+# has no animal in it from the recorder's motion statistics: motion which was mostly
+# whole-frame changes (lighting), or which only just crossed MD_IMAGE_CHANGE_THRESHOLD
+# at its peak. Anything warm seen by the thermal camera at the same time vetoes it.
+@timed('cascade')
+def cascade_no_animal_confidence(video, thermal_clips):
+    stats = video.get('motion_stats')
+    if not stats or not stats['frames']:
+        return 0.0
+
+    if thermal_clips_during(video, thermal_clips):
+        return 0.0
+
+    lighting = stats['global_change_frames'] / stats['frames']
+
+    animal_range = max(1e-6, config.VP_CASCADE_ANIMAL_CHANGE - config.MD_IMAGE_CHANGE_THRESHOLD)
+    too_small = np.clip((config.VP_CASCADE_ANIMAL_CHANGE - stats['peak_changed']) / animal_range, 0.0, 1.0)
+
+    return float(max(lighting, too_small))
+
+# Counts how often the cascade rejects (or in 'record' mode would reject) clips, time
+# saved is estimated from the average time taken to classify the clips which were
+# not rejected. In 'record' mode clips it would have rejected are still classified,
+# missed_animals counts those the model kept as an event.
+class CascadeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.evaluated = 0
+        self.would_reject = 0
+        self.rejected = 0
+        self.missed_animals = 0
+        self.classified = 0
+        self.classify_s = 0.0
+
+    def record(self, would_reject, rejected, kept):
+        with self.lock:
+            self.evaluated += 1
+            self.would_reject += int(would_reject)
+            self.rejected += int(rejected)
+            self.missed_animals += int(would_reject and kept)
+
+    def record_inference(self, seconds):
+        with self.lock:
+            self.classified += 1
+            self.classify_s += seconds
+
+    def report(self, shared):
+        with self.lock:
+            mean_classify_s = self.classify_s / self.classified if self.classified else 0.0
+            shared['vp_cascade'] = {
+                'mode': config.VP_CASCADE_MODE,
+                'evaluated': self.evaluated,
+                'would_reject': self.would_reject,
+                'rejected': self.rejected,
+                'missed_animals': self.missed_animals,
+                'hit_rate': self.would_reject / self.evaluated if self.evaluated else 0.0,
+                'time_saved_s': self.rejected * mean_classify_s,
+            }
+
+cascade_stats = CascadeStats()
+
+# weights the model's crossing classes towards the thermal direction
+def thermal_prior(thermal):
+    if thermal is None:
+        return None
+
+    crossings = [config.VC_EVENT_CLASSES['WENT_INSIDE'], config.VC_EVENT_CLASSES['WENT_OUTSIDE']]
+    weight = config.VP_THERMAL_PRIOR_WEIGHT * thermal['direction_confidence']
+    prior = np.ones((len(class_map),), dtype='float32')
+
+    for model_class, config_classes in class_map.items():
+        if config_classes != 'DISCARD' and config_classes[1] in crossings:
+            prior[model_class] = 1 + weight if config_classes[1] == thermal['direction'] else 1 - weight
+
+    return prior
+
+@timed('classify')
+def classify_video(video_path: str, model, model_input=None, prior=None):
+    if model_input is None:
+        config.logger.info('preprocessing video %s' % video_path)
+        model_input = preprocess_video(video_path, ffmpeg_threads=worker_threads())
+        config.logger.info('preprocessed video')
     
     config.logger.info('classifying %s' % video_path)
 
-    input_details = model.get_input_details()
-    tensor_index = model.get_input_details()[0]['index']
-
-    batched_shape = (1,) + config.VC_INPUT_SHAPE
-    model_input = model_input.reshape(batched_shape)
-    model.set_tensor(input_details[0]['index'], model_input)
+    prediction = model.predict(model_input)
+    if prior is not None:
+        prediction = prediction * prior
 
-    model.invoke()
-
-    output_details = model.get_output_details()
-    prediction = model.get_tensor(output_details[0]['index'])
-
-    class_prediction = np.argmax(prediction[0])
+    class_prediction = np.argmax(prediction)
 
     if class_map[class_prediction] == 'DISCARD':
         return (None, None)
@@ -101,6 +542,9 @@ def classify_video(video_path: str, model):
 
     return pet_class, event_class
 
+# used when the positions of the model frames in the clip are unknown, eg. when
+# they were preprocessed by ffmpeg
+@timed('poster_ffmpeg')
 def generate_video_frame(video_path):
     file_name = os.path.basename(video_path)[:-4]
     out_path = config.VP_FRAMES_DIR + '/frame-' + file_name + '.jpg'
@@ -112,7 +556,7 @@ def generate_video_frame(video_path):
         '-v',
         'error',
         '-threads',
-        str(config.VP_FFMPEG_THREADS),
+        str(worker_threads()),
         '-i',
         video_path,
         '-vf', 
@@ -137,7 +581,20 @@ def link_to_pub_dir(path):
 
     return link_name
 
+def unlink_pub_file(link_name):
+    if link_name and os.path.exists(config.VP_PUBLIC_DIR + '/' + link_name):
+        os.remove(config.VP_PUBLIC_DIR + '/' + link_name)
+
+def unlink_renditions(renditions):
+    if not renditions:
+        return
+
+    unlink_pub_file(renditions['preview'])
+    unlink_pub_file(renditions['sprite']['file_name'])
+    for link_name in renditions['thumbnails'].values():
+        unlink_pub_file(link_name)
+
 if __name__ == '__main__':
-    queue = Queue()
+    queue = JobQueue(config.VP_JOB_QUEUE_PATH)
     queue.put({'type': 'motion', 'path': '/Users/elliotlevin/Temp/motion/dataset/motion.2021-02-04T18-32-03.mp4'})
     video_processor(queue, {})
\ No newline at end of file
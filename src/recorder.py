@@ -1,25 +1,37 @@
-from .config import config, TempRange
+from .config import config
+from .frame_buffer import create_pre_roll_buffer, SharedFrames
+from .frame_scheduler import FrameScheduler
+from .frame_source import CameraFrameSource, FileFrameSource
+from .video_writer import open_video_writer, AsyncVideoWriter
+from .ml.preprocess import UniformFrameSampler, RollingFrameWindow, SAMPLER_CAPACITY, to_model_frame
 
-from imutils.video import VideoStream
 import datetime
 import pytz
 import imutils
+from abc import ABC, abstractmethod
 from time import sleep, time
 import cv2
 import numpy as np
 import os
 import astral.sun
-from sys import platform
+import sys
+import signal
+import threading
 
-def start_recorder(queue = None, shared = {}, debug = False):
-    vs = VideoStream(src=0, resolution=config.MD_RESOLUTION, usePiCamera='linux' in platform)
-    vs_stream = vs.start()
+BLUR_KERNEL = (21, 21)
 
-    sleep(5.0)
+def start_recorder(queue = None, shared = {}, thermal_motion = None, debug = False, source = None):
+    if source is None:
+        source = CameraFrameSource()
+    source.start()
 
-    prev_frame = None
-    compare_frame = None
-    last_compare_frame_at = None
+    pre_roll = create_pre_roll_buffer()
+    scheduler = FrameScheduler('recorder', shared, {
+        'IDLE': config.MD_THERMAL_GATE_IDLE_FPS,
+        'STILL': config.MD_STILL_FPS,
+        'MOTION': config.MD_MOTION_FPS,
+    })
+    detector = create_motion_detector()
 
     state = "STILL"
     state_change_at = None
@@ -27,22 +39,103 @@ def start_recorder(queue = None, shared = {}, debug = False):
 
     video = None
     video_path = None
+    # writers which have not finished writing their clip yet
+    writers = set()
+    model_frames = None
+    sampler = None
+    live_window = None
+    live_windows_sent = 0
+    motion_stats = None
 
     config.logger.info("starting recorder loop...")
 
     def start_video_file():
-        video_path = config.MD_STORAGE_PATH + '/motion.' + datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S') + '.avi'  
+        base_path = config.MD_STORAGE_PATH + '/motion.' + datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+        writer, video_path = open_video_writer(base_path, config.MD_MOTION_FPS, config.MD_RESOLUTION)
         config.logger.info('writing video to %s' % video_path)
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        video = cv2.VideoWriter(video_path, fourcc, config.MD_MOTION_FPS, config.MD_RESOLUTION, isColor=True)
+        # frames are written from the ring buffer slots, which stay pinned until written
+        video = AsyncVideoWriter(writer, video_path, frame_buffer=pre_roll, max_queued=pre_roll.capacity)
+        writers.add(video)
         return video, video_path
 
+    # the model input is sampled while recording so the processor does not need to decode the video
+    def start_model_frames():
+        model_frames = SharedFrames.create((SAMPLER_CAPACITY,) + config.VC_INPUT_SHAPE[1:])
+        return model_frames, UniformFrameSampler(model_frames.array), RollingFrameWindow()
+
     def write_frame_to_video(video, frame):
-        video.write(frame)
+        video_index = video.write(frame)
 
-    def end_video(video, video_path):
-        video.release()
-        config.logger.info('finished writing to video')
+        if frame is None:
+            return
+
+        model_frame = None
+        def read_model_frame():
+            nonlocal model_frame
+            if model_frame is None:
+                model_frame = to_model_frame(frame)
+            return model_frame
+
+        # frames the writer dropped are still classified but are not in the clip, they
+        # are marked -1 so the poster is never looked up from them
+        sampler.push(read_model_frame, -1 if video_index is None else video_index)
+        if live_window.push(read_model_frame):
+            send_live_window()
+
+    # periodically hands the latest frames to the processor so it can classify the
+    # clip before it finishes recording
+    def send_live_window():
+        nonlocal live_windows_sent
+
+        if queue is None or not config.VC_LIVE_ENABLED or not live_window.is_full():
+            return
+
+        if live_windows_sent >= config.VC_LIVE_MAX_WINDOWS:
+            return
+
+        if (live_window.count - live_window.frames.shape[0]) % config.VC_LIVE_WINDOW_STRIDE != 0:
+            return
+
+        # the clip's own block is not handed off yet
+        if not SharedFrames.can_hand_off(own=1):
+            config.logger.info('too many frame blocks waiting for the processor, not sending live window for %s' % video_path)
+            return
+
+        window_frames = SharedFrames.create(config.VC_INPUT_SHAPE)
+        live_window.copy_to(window_frames.array)
+        message = {
+            'type': 'motion_window',
+            'path': video_path,
+            'frames': window_frames.handle(),
+            # the same as the clip's, so the provisional event has the clip's time
+            'started_at': state_change_at - config.MD_PRE_ROLL_S,
+        }
+
+        # queueing is a sqlite commit, it is done on the writer thread so capture never
+        # waits for it
+        def post_window():
+            window_frames.hand_off()
+            try:
+                queue.put(message)
+            except Exception:
+                SharedFrames.attach(message['frames']).release()
+                raise
+
+        if not video.defer(post_window):
+            config.logger.info('writer is behind, not sending live window for %s' % video_path)
+            window_frames.release()
+            return
+
+        live_windows_sent += 1
+
+    def end_video(video, video_path, on_finished):
+        def on_released():
+            shared['recorder_writer'] = video.stats()
+            on_finished()
+            writers.discard(video)
+
+        video.release(on_released)
+        config.logger.info('finishing writing to video')
         
     def is_day(cache = {}):
         now = datetime.datetime.now(config.MD_LOCATION_INFO.tzinfo)
@@ -61,143 +154,335 @@ def start_recorder(queue = None, shared = {}, debug = False):
         else:
             return config.MD_NIGHT_BRIGHTNESS
 
+    # while the thermal camera sees nothing the camera pipeline idles at a low rate,
+    # gating is only applied while the thermal recorder is known to be running
+    def is_thermal_gated():
+        if not config.MD_THERMAL_GATE_ENABLED or thermal_motion is None or state != "STILL":
+            return False
+
+        if time() - shared.get('thermal_alive_at', 0) > config.MD_THERMAL_GATE_HEARTBEAT_S:
+            return False
+
+        return not thermal_motion.is_set()
+
     def get_pixel_change_threshold():
         if is_day():
             return config.MD_DAY_PIXEL_CHANGE_THRESHOLD
         else:
             return config.MD_NIGHT_PIXEL_CHANGE_THRESHOLD
 
+    # terminate() from the process manager unwinds through the cleanup below
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
     # set initial brightness and sleep to avoid brightness flicker triggering motion detection
-    if hasattr(vs.stream, 'camera'):
-        vs.stream.camera.brightness = calc_brightness()
-        sleep(0.5)
+    source.set_brightness(calc_brightness())
+    sleep(0.5)
 
-    while True:
-        if hasattr(vs.stream, 'camera'):
-            vs.stream.camera.brightness = calc_brightness()
+    try:
+        while True:
+            scheduler.start_frame()
 
-        # grab the current frame and initialize the occupied/unoccupied
-        # text
-        frame = vs_stream.read()
+            source.set_brightness(calc_brightness())
 
-        # if the frame could not be grabbed, then we have reached the end
-        # of the video
-        if frame is None:
-            config.logger.error("Could not retrieve frame, ending...")
-            break
-
-        # resize the frame, convert it to grayscale, and blur it
-        orig_frame = frame
-        frame = imutils.resize(frame, width=config.MD_RESIZE_WIDTH, inter=cv2.INTER_NEAREST)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
-
-        if compare_frame is None:
-            compare_frame = gray
-            last_compare_frame_at = time()
-            continue
-
-        frameDelta = cv2.absdiff(compare_frame, gray)
-        thresh = cv2.threshold(frameDelta, get_pixel_change_threshold(), 255, cv2.THRESH_BINARY)[1]
-
-        # calculate portion of pixels that changed
-        amount_changed = np.count_nonzero(thresh) / thresh.size
-        detected_motion = amount_changed > config.MD_IMAGE_CHANGE_THRESHOLD
-
-        # sleep until next frame at desired FPS
-        # todo: this is not really tracking at the right fps since it does not account
-        # for processing time of each frame but is good for keeping a consistent cpu usage
-        # which helps with temperature management, this can be improved to calculate the time
-        # until the next frame and potentially slow if temp rises beyond a threshold 
-        def sleep_interval(state):
-            nonlocal shared
-
-            base_interval = 1 / (config.MD_STILL_FPS if state == "STILL" else config.MD_MOTION_FPS)
-
-            if 'temp' in shared and 'range' in shared['temp']:
-                r = shared['temp']['range']
-                if r == TempRange.HOT:
-                    base_interval *= 2
-                elif r == TempRange.VERY_HOT:
-                    base_interval *= 8
-                elif r == TempRange.DANGEROUS:
-                    config.logger.info('cpu is dangerously hot, sleeping for 60s')
-                    base_interval = 60
-            
-            return base_interval
-
-
-        if detected_motion:
-            last_motion_at = time()
-
-        motion_duration = time() - state_change_at if state_change_at else 0
-        stillness_duration = time() - last_motion_at if last_motion_at else 0
-
-        def end_motion():
-            nonlocal state, state_change_at, compare_frame, video, video_path
-            end_video(video, video_path)
-
-            if queue is not None:
-                queue.put({'type': 'motion', 'path': video_path})
-
-            state = "STILL"
-            state_change_at = time()
-            video = None
-            video_path = None
-
-        # start recording
-        if state == "STILL" and detected_motion:
-            config.logger.info('motion started')
-            state = "MOTION"
-            state_change_at = time()
-            video, video_path = start_video_file()
-            if prev_frame is not None:
-                write_frame_to_video(video, prev_frame)
-            write_frame_to_video(video, orig_frame)
-        # stop recording (max duration exceeded)
-        elif state == "MOTION" and motion_duration > config.MD_MAX_DURATION_S:
-            config.logger.info('motion stopped (max time exceeded)')
-            write_frame_to_video(video, orig_frame)
-            end_motion()
-        # stop recording (motion stopped)
-        elif state == "MOTION" and stillness_duration > config.MD_MIN_DURATION_S:
-            config.logger.info('motion stopped')
+            # grab the current frame and initialize the occupied/unoccupied
+            # text
+            frame = source.read()
+
+            # if the frame could not be grabbed, then we have reached the end
+            # of the video
+            if frame is None:
+                config.logger.error("Could not retrieve frame, ending...")
+                break
+
+            if frame.shape != pre_roll.frame_shape:
+                frame = cv2.resize(frame, config.MD_RESOLUTION)
+
+            # keep the frame in the pre-roll buffer, the returned slot is used from
+            # here on so the frame is never copied again when written to video. If the
+            # writer is too far behind to free a slot the frame is dropped from the video.
+            orig_frame = pre_roll.push(frame, time())
+
+            # resize the frame, convert it to grayscale, and blur it
+            frame = imutils.resize(frame, width=config.MD_RESIZE_WIDTH, inter=cv2.INTER_NEAREST)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            gray = cv2.GaussianBlur(gray, BLUR_KERNEL, 0)
+
+            motion = detector.detect(gray, get_pixel_change_threshold())
+            detected_motion = motion.detected
+
+            if detected_motion:
+                last_motion_at = time()
+
+            motion_duration = time() - state_change_at if state_change_at else 0
+            stillness_duration = time() - last_motion_at if last_motion_at else 0
+
+            # summarises the detector's view of the clip, used by the processor to skip
+            # clips which are obviously not an animal (see cascade_no_animal_confidence)
+            def update_motion_stats():
+                motion_stats['frames'] += 1
+                motion_stats['motion_frames'] += int(motion.detected)
+                motion_stats['global_change_frames'] += int(motion.global_change)
+                if motion.detected:
+                    motion_stats['peak_changed'] = max(motion_stats['peak_changed'], float(motion.amount_changed))
+                    motion_stats['peak_tile'] = max(motion_stats['peak_tile'], float(np.max(motion.tile_scores)))
+
+            def end_motion():
+                nonlocal state, state_change_at, video, video_path, model_frames, sampler, live_window
+                sampler.finish()
+                frame_indices = sampler.picked_indices
+                sampler = None
+                live_window = None
+
+                message = {
+                    'type': 'motion',
+                    'path': video_path,
+                    'frames': model_frames.handle(),
+                    # position of each model frame in the clip, used to pick the poster
+                    'frame_indices': frame_indices,
+                    # includes the pre-roll, used to match thermal clips recorded alongside
+                    'started_at': state_change_at - config.MD_PRE_ROLL_S,
+                    'ended_at': time(),
+                    'motion_stats': motion_stats,
+                }
+
+                clip_video = video
+                clip_frames = model_frames
+
+                def on_finished():
+                    # the clip is only queued once the writer has finalised it, a clip which
+                    # could not be written is dropped along with its frames
+                    if queue is None or clip_video.failed:
+                        if clip_video.failed:
+                            config.logger.error('could not write %s, not queueing it for processing' % message['path'])
+                        clip_frames.release()
+                        return
+
+                    if not SharedFrames.can_hand_off(own=1):
+                        config.logger.warning('too many frame blocks waiting for the processor, queueing %s without its frames' % message['path'])
+                        clip_frames.release()
+                        del message['frames']
+                        del message['frame_indices']
+                        queue.put(message)
+                        return
+
+                    clip_frames.hand_off()
+                    queue.put(message)
+
+                end_video(video, video_path, on_finished)
+
+                state = "STILL"
+                state_change_at = time()
+                video = None
+                video_path = None
+                model_frames = None
+
+                # frames already in the clip should not be replayed as pre-roll of the next one
+                pre_roll.clear()
+
+            # start recording
+            if state == "STILL" and detected_motion:
+                config.logger.info('motion started (%.1f%% changed, peak tile %.1f%%)'
+                    % (motion.amount_changed * 100, np.max(motion.tile_scores) * 100))
+                state = "MOTION"
+                state_change_at = time()
+                video, video_path = start_video_file()
+                model_frames, sampler, live_window = start_model_frames()
+                live_windows_sent = 0
+                motion_stats = {'frames': 0, 'motion_frames': 0, 'global_change_frames': 0, 'peak_changed': 0.0, 'peak_tile': 0.0}
+                update_motion_stats()
+                # flush the pre-roll (which includes the current frame) into the clip
+                for pre_roll_frame in pre_roll_at_motion_fps(pre_roll.frames_since(time() - config.MD_PRE_ROLL_S)):
+                    write_frame_to_video(video, pre_roll_frame)
+            # stop recording (max duration exceeded)
+            elif state == "MOTION" and motion_duration > config.MD_MAX_DURATION_S:
+                config.logger.info('motion stopped (max time exceeded)')
+                write_frame_to_video(video, orig_frame)
+                update_motion_stats()
+                end_motion()
+            # stop recording (motion stopped)
+            elif state == "MOTION" and stillness_duration > config.MD_MIN_DURATION_S:
+                config.logger.info('motion stopped')
+                end_motion()
+            # continue recording
+            elif state == "MOTION":
+                write_frame_to_video(video, orig_frame)
+                update_motion_stats()
+
+            # sleep until the next frame deadline at the governed FPS
+            if is_thermal_gated():
+                scheduler.wait('IDLE', wake=thermal_motion)
+            else:
+                scheduler.wait(state)
+
+            if debug:
+                # draw the text and timestamp on the frame
+                cv2.putText(frame, "Room Status: {}".format(state), (10, 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+                cv2.putText(frame, datetime.datetime.now().strftime("%A %d %B %Y %I:%M:%S%p"),
+                    (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 255), 1)
+
+                # show the frame and record if the user presses a key
+                cv2.imshow("Security Feed", frame)
+                cv2.imshow("Thresh", motion.mask)
+                cv2.imshow("Frame Delta", motion.delta)
+                key = cv2.waitKey(1) & 0xFF
+
+                # if the `q` key is pressed, break from the lop
+                if key == ord("q"):
+                    break
+    finally:
+        # the clip being recorded is finished and queued, and every writer is waited
+        # for so no clip is left truncated
+        if state == "MOTION" and video is not None:
             end_motion()
-        # continue recording
-        elif state == "MOTION":
-            write_frame_to_video(video, orig_frame)
 
-        sleep(sleep_interval(state))
+        for writer in list(writers):
+            if not writer.join(config.MD_WRITER_JOIN_TIMEOUT_S):
+                config.logger.warning('timed out waiting for %s to be written' % writer.video_path)
+
+        # cleanup the camera and close any open windows
+        source.stop()
+        pre_roll.close()
+        cv2.destroyAllWindows()
+
+# The pre-roll is captured at the STILL (or idle) rate but the clip is encoded at
+# MD_MOTION_FPS, each frame is repeated until the next one was captured so the
+# pre-roll plays back at its real speed
+def pre_roll_at_motion_fps(timed_frames):
+    frames = []
+
+    for i, (timestamp, frame) in enumerate(timed_frames):
+        next_timestamp = timed_frames[i + 1][0] if i + 1 < len(timed_frames) else timestamp
+        frames += [frame] * max(1, round((next_timestamp - timestamp) * config.MD_MOTION_FPS))
+
+    return frames
+
+class MotionResult:
+    def __init__(self, detected, global_change, amount_changed, tile_scores, delta, mask):
+        self.detected = detected
+        # most of the frame changed at once, likely lighting rather than motion
+        self.global_change = global_change
+        # portion of pixels (within the roi) that changed
+        self.amount_changed = amount_changed
+        # portion of pixels that changed in each tile of the MD_TILE_GRID
+        self.tile_scores = tile_scores
+        self.delta = delta
+        self.mask = mask
+
+# Interface for motion detectors, detect() is called with each blurred
+# grayscale frame and the current pixel change threshold
+class MotionDetector(ABC):
+    def __init__(self):
+        self.roi_mask = None
+        self.roi_tile_portion = None
+
+    @abstractmethod
+    def detect(self, gray, pixel_threshold) -> MotionResult:
+        pass
+
+    def init_roi(self, frame_shape):
+        if config.MD_ROI_MASK_PATH:
+            mask = cv2.imread(config.MD_ROI_MASK_PATH, cv2.IMREAD_GRAYSCALE)
+            mask = cv2.resize(mask, (frame_shape[1], frame_shape[0]), interpolation=cv2.INTER_NEAREST)
+            self.roi_mask = mask > 0
+        else:
+            self.roi_mask = np.ones(frame_shape, dtype='bool')
+
+        self.roi_tile_portion = self.tile_means(self.roi_mask)
 
-        # keep previous frame for writing to video if motion occurs
-        prev_frame = orig_frame
+    def tile_means(self, mask):
+        rows, cols = config.MD_TILE_GRID
+        return cv2.resize(mask.astype('float32'), (cols, rows), interpolation=cv2.INTER_AREA)
+
+    def result(self, changed, delta):
+        changed &= self.roi_mask
+
+        amount_changed = np.count_nonzero(changed) / max(1, np.count_nonzero(self.roi_mask))
+        tile_scores = np.divide(self.tile_means(changed), self.roi_tile_portion,
+            out=np.zeros(config.MD_TILE_GRID, dtype='float32'), where=self.roi_tile_portion > 0)
+
+        changed_tiles = np.count_nonzero(tile_scores > config.MD_TILE_CHANGE_THRESHOLD)
+        # lighting changes reach every tile, a pet close to the camera can change most
+        # of them but leaves some of the doorway untouched
+        untouched_tiles = np.count_nonzero((tile_scores < config.MD_GLOBAL_CHANGE_UNTOUCHED_TILE) & (self.roi_tile_portion > 0))
+        global_change = changed_tiles >= config.MD_GLOBAL_CHANGE_TILE_PORTION * tile_scores.size and untouched_tiles == 0
+
+        detected = amount_changed > config.MD_IMAGE_CHANGE_THRESHOLD and changed_tiles > 0 and not global_change
+
+        return MotionResult(detected, global_change, amount_changed, tile_scores, delta, changed.view('uint8') * 255)
+
+# Compares each frame with a single reference frame, refreshed on motion or every 60s
+class CompareFrameDetector(MotionDetector):
+    def __init__(self):
+        super().__init__()
+        self.compare_frame = None
+        self.last_compare_frame_at = None
+
+    def detect(self, gray, pixel_threshold):
+        if self.compare_frame is None:
+            self.init_roi(gray.shape)
+            self.compare_frame = gray
+            self.last_compare_frame_at = time()
+
+        delta = cv2.absdiff(self.compare_frame, gray)
+        result = self.result(delta > pixel_threshold, delta)
 
         # use latest motion frame to compare with next frame
-        if detected_motion or time() - last_compare_frame_at > 60:
-            compare_frame = gray
-            last_compare_frame_at = time()
-
-        if debug:
-            # draw the text and timestamp on the frame
-            cv2.putText(frame, "Room Status: {}".format(state), (10, 20),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-            cv2.putText(frame, datetime.datetime.now().strftime("%A %d %B %Y %I:%M:%S%p"),
-                (10, frame.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 255), 1)
-
-            # show the frame and record if the user presses a key
-            cv2.imshow("Security Feed", frame)
-            cv2.imshow("Thresh", thresh)
-            cv2.imshow("Frame Delta", frameDelta)
-            key = cv2.waitKey(1) & 0xFF
-
-            # if the `q` key is pressed, break from the lop
-            if key == ord("q"):
-                break
+        if result.detected or result.global_change or time() - self.last_compare_frame_at > 60:
+            self.compare_frame = gray
+            self.last_compare_frame_at = time()
+
+        return result
+
+# Keeps a running mean and variance of each pixel, pixels are considered changed when
+# they deviate from the mean by more than the pixel threshold and MD_BG_Z_THRESHOLD
+# standard deviations. Gradual lighting drift is absorbed into the model while sudden
+# changes across most of the frame (lights, clouds) re-seed it rather than trigger.
+class BackgroundModelDetector(MotionDetector):
+    def __init__(self):
+        super().__init__()
+        self.mean = None
+        self.var = None
+        self.diff = None
+        self.rate = None
+
+    def detect(self, gray, pixel_threshold):
+        if self.mean is None:
+            self.init_roi(gray.shape)
+            self.mean = gray.astype('float32')
+            self.var = np.full(gray.shape, config.MD_BG_MIN_STD ** 2, dtype='float32')
+            self.diff = np.zeros(gray.shape, dtype='float32')
+            self.rate = np.zeros(gray.shape, dtype='float32')
+
+        np.subtract(gray, self.mean, out=self.diff)
+        abs_diff = np.abs(self.diff)
+
+        changed = (abs_diff > pixel_threshold) & (np.square(abs_diff) > self.var * config.MD_BG_Z_THRESHOLD ** 2)
+        result = self.result(changed, abs_diff.astype('uint8'))
+
+        if result.global_change:
+            self.mean[:] = gray
+        else:
+            # changed pixels are learnt slowly so a still pet does not vanish into the background
+            self.rate[:] = config.MD_BG_LEARNING_RATE
+            self.rate[changed] = config.MD_BG_FOREGROUND_LEARNING_RATE
+
+            self.mean += self.rate * self.diff
+            self.var += self.rate * (np.square(self.diff) - self.var)
+            np.maximum(self.var, config.MD_BG_MIN_STD ** 2, out=self.var)
+
+        return result
+
+def create_motion_detector() -> MotionDetector:
+    if config.MD_DETECTOR == 'compare':
+        return CompareFrameDetector()
+    elif config.MD_DETECTOR == 'background':
+        return BackgroundModelDetector()
 
-    # cleanup the camera and close any open windows
-    vs_stream.stop()
-    cv2.destroyAllWindows()
+    raise ValueError('unknown motion detector %s' % config.MD_DETECTOR)
 
 if __name__ == '__main__':
     print('pid: ', os.getpid())
-    start_recorder(debug=True)
+    # optionally replay a video file or directory of clips instead of the camera
+    start_recorder(debug=True, source=FileFrameSource(sys.argv[1]) if len(sys.argv) > 1 else None)
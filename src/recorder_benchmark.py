@@ -0,0 +1,100 @@
+from .config import config
+from .frame_source import FileFrameSource
+from .recorder import BLUR_KERNEL, create_motion_detector
+from .video_writer import open_video_writer
+
+from time import perf_counter, process_time
+import tempfile
+import resource
+import imutils
+import cv2
+import numpy as np
+import os
+import sys
+
+# Runs the recorder's per-frame pipeline over replayed video and reports the
+# throughput and cost of each stage, every frame is written to video as if
+# motion was being recorded. The cpu per frame includes the ffmpeg encoder process
+# (h264), which is only known once it has exited.
+def benchmark_recorder(path, realtime=False):
+    source = FileFrameSource(path, realtime=realtime)
+    source.start()
+
+    detector = create_motion_detector()
+    pixel_threshold = config.MD_DAY_PIXEL_CHANGE_THRESHOLD
+
+    out_dir = tempfile.mkdtemp()
+    video, video_path = open_video_writer(out_dir + '/benchmark', config.MD_MOTION_FPS, config.MD_RESOLUTION)
+
+    stages = ['read', 'resize', 'cvtColor', 'GaussianBlur', 'absdiff', 'threshold', 'detect', 'VideoWriter.write']
+    timings = {stage: [] for stage in stages}
+    cpu_times = []
+    prev_gray = None
+
+    def timed(stage, fn, *args):
+        started_at = perf_counter()
+        result = fn(*args)
+        timings[stage].append(perf_counter() - started_at)
+        return result
+
+    children_started_at = children_cpu_time()
+    started_at = perf_counter()
+
+    while True:
+        cpu_started_at = process_time()
+
+        frame = timed('read', source.read)
+        if frame is None:
+            break
+
+        small = timed('resize', lambda: imutils.resize(frame, width=config.MD_RESIZE_WIDTH, inter=cv2.INTER_NEAREST))
+        gray = timed('cvtColor', cv2.cvtColor, small, cv2.COLOR_BGR2GRAY)
+        gray = timed('GaussianBlur', cv2.GaussianBlur, gray, BLUR_KERNEL, 0)
+
+        # the individual ops of the frame comparison, followed by the configured detector as a whole
+        delta = timed('absdiff', cv2.absdiff, prev_gray if prev_gray is not None else gray, gray)
+        timed('threshold', cv2.threshold, delta, pixel_threshold, 255, cv2.THRESH_BINARY)
+        timed('detect', detector.detect, gray, pixel_threshold)
+        prev_gray = gray
+
+        timed('VideoWriter.write', video.write, frame)
+
+        cpu_times.append(process_time() - cpu_started_at)
+
+    elapsed = perf_counter() - started_at
+
+    source.stop()
+    video.release()
+    encoder_cpu = children_cpu_time() - children_started_at
+    os.remove(video_path)
+    os.rmdir(out_dir)
+
+    frames = len(cpu_times)
+    if not frames:
+        print('no frames read from %s' % path)
+        return
+
+    print('frames:         %d' % frames)
+    print('throughput:     %.1f fps' % (frames / elapsed))
+    print('cpu per frame:  %.2f ms (%.2f ms recorder, %.2f ms encoder process)' % (
+        (np.sum(cpu_times) + encoder_cpu) / frames * 1000, np.mean(cpu_times) * 1000, encoder_cpu / frames * 1000))
+    print('wall per frame: %.2f ms' % (elapsed / frames * 1000))
+    print()
+    print('%-18s %10s %10s %10s' % ('stage', 'mean ms', 'p95 ms', 'share'))
+
+    total = sum(np.sum(t) for t in timings.values())
+    for stage in stages:
+        t = np.array(timings[stage]) * 1000
+        print('%-18s %10.3f %10.3f %9.1f%%' % (stage, np.mean(t), np.percentile(t, 95), np.sum(t) / 1000 / total * 100))
+
+# user and system time of the child processes which have exited, ie. ffmpeg
+def children_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python -m src.recorder_benchmark [video file or dir] [--realtime]')
+        sys.exit(1)
+
+    benchmark_recorder(sys.argv[1], realtime='--realtime' in sys.argv)
@@ -0,0 +1,139 @@
+import cv2
+import numpy as np
+import os
+
+from .config import config
+from .video_writer import FfmpegVideoWriter
+from .instrumentation import timed
+from .ml.preprocess import UniformFrameSampler
+
+# Small versions of an event's media for the dashboard's timeline and sightings,
+# which otherwise load the full 640x480 mp4 and jpeg for every item: a low bitrate
+# preview mp4, webp thumbnails of the poster and a webp sprite sheet of frames spread
+# over the clip for scrubbing. The clip is decoded once in-process, scaled frames are
+# streamed to ffmpeg for the preview and the sprite tiles are taken on the way.
+class Renditions:
+    def __init__(self, preview_path, thumbnail_paths, sprite_path, sprite):
+        self.preview_path = preview_path
+        # width -> path
+        self.thumbnail_paths = thumbnail_paths
+        self.sprite_path = sprite_path
+        # layout of the sprite sheet, see sprite_sheet()
+        self.sprite = sprite
+
+    def paths(self):
+        return [self.preview_path, self.sprite_path] + list(self.thumbnail_paths.values())
+
+    def remove(self):
+        for path in self.paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+def scaled_size(frame, width):
+    # h.264 needs even dimensions
+    height = round(frame.shape[0] * width / frame.shape[1] / 2) * 2
+    return (width, height)
+
+def write_thumbnails(poster_path, base_path):
+    poster = cv2.imread(poster_path)
+    if poster is None:
+        return None
+
+    thumbnail_paths = {}
+    for width in config.VP_THUMBNAIL_WIDTHS:
+        thumbnail = cv2.resize(poster, scaled_size(poster, width), interpolation=cv2.INTER_AREA)
+        thumbnail_paths[width] = '%s-%d.webp' % (base_path, width)
+        cv2.imwrite(thumbnail_paths[width], thumbnail, [cv2.IMWRITE_WEBP_QUALITY, config.VP_RENDITION_WEBP_QUALITY])
+
+    return thumbnail_paths
+
+# lays the tiles out in rows of VP_SPRITE_COLUMNS, returns the sheet and its layout
+def sprite_sheet(tiles, duration_s):
+    columns = min(config.VP_SPRITE_COLUMNS, len(tiles))
+    rows = -(-len(tiles) // columns)
+    tile_height, tile_width = tiles[0].shape[:2]
+
+    sheet = np.zeros((rows * tile_height, columns * tile_width, 3), dtype='uint8')
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, columns)
+        sheet[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = tile
+
+    return sheet, {
+        'columns': columns,
+        'rows': rows,
+        'tiles': len(tiles),
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+        'interval_s': round(duration_s / len(tiles), 3),
+    }
+
+# Returns None if the clip or its poster cannot be read, nothing is left behind
+@timed('renditions')
+def generate_renditions(video_path, poster_path, threads=None):
+    os.makedirs(config.VP_RENDITIONS_DIR, exist_ok=True)
+    base_path = config.VP_RENDITIONS_DIR + '/' + os.path.basename(video_path).rsplit('.', 1)[0]
+    preview_path = base_path + '-preview.mp4'
+    sprite_path = base_path + '-sprite.webp'
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        config.logger.warning('could not open %s for renditions' % video_path)
+        return None
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or config.MD_MOTION_FPS
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    # the frames to tile, when the container does not know its length a sampler keeps
+    # a bounded number of tiles spread over the frames read so far
+    picks = set(np.linspace(0, frame_count - 1, config.VP_SPRITE_TILES).round().astype('int')) if frame_count > 0 else None
+    sampler = None
+
+    writer = None
+    tiles = []
+    frames = 0
+
+    try:
+        while True:
+            grabbed, frame = capture.read()
+            if not grabbed:
+                break
+
+            if writer is None:
+                writer = FfmpegVideoWriter(preview_path, fps, scaled_size(frame, config.VP_PREVIEW_WIDTH),
+                    crf=config.VP_PREVIEW_CRF, max_bitrate=config.VP_PREVIEW_MAX_BITRATE, threads=threads)
+
+            preview = cv2.resize(frame, scaled_size(frame, config.VP_PREVIEW_WIDTH), interpolation=cv2.INTER_AREA)
+            writer.write(preview)
+
+            tile_size = scaled_size(preview, config.VP_SPRITE_TILE_WIDTH)
+            if picks is None:
+                if sampler is None:
+                    tile_buffer = np.zeros((config.VP_SPRITE_TILES * 2, tile_size[1], tile_size[0], 3), dtype='uint8')
+                    sampler = UniformFrameSampler(tile_buffer, picks=config.VP_SPRITE_TILES, interval=1)
+                sampler.push(lambda: cv2.resize(preview, tile_size, interpolation=cv2.INTER_AREA))
+            elif frames in picks:
+                tiles.append(cv2.resize(preview, tile_size, interpolation=cv2.INTER_AREA))
+
+            frames += 1
+    finally:
+        capture.release()
+
+        if writer is not None:
+            writer.release()
+
+    if frames == 0 or writer.failed or not os.path.exists(preview_path):
+        config.logger.warning('could not decode %s for renditions' % video_path)
+        return None
+
+    thumbnail_paths = write_thumbnails(poster_path, base_path)
+    if thumbnail_paths is None:
+        config.logger.warning('could not read poster %s for renditions' % poster_path)
+        os.remove(preview_path)
+        return None
+
+    if sampler is not None:
+        tiles = list(sampler.finish()[:sampler.count])
+
+    sheet, sprite = sprite_sheet(tiles, frames / fps)
+    cv2.imwrite(sprite_path, sheet, [cv2.IMWRITE_WEBP_QUALITY, config.VP_RENDITION_WEBP_QUALITY])
+
+    return Renditions(preview_path, thumbnail_paths, sprite_path, sprite)
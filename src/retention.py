@@ -0,0 +1,310 @@
+from datetime import datetime, timezone, timedelta
+from time import sleep, time
+from sys import platform
+import subprocess
+import shutil
+import os
+
+from .config import config
+from . import db
+
+# Keeps the media on the sd card in check, otherwise raw clips, public links,
+# posters, renditions and the preprocess cache grow until the card fills up:
+#  - events older than MD_STORAGE_MAX_AGE (and any other media file not modified
+#    since then) are deleted, in batches of RT_DELETE_BATCH with pauses between them
+#  - clips of events older than RT_COMPACT_AFTER_S are transcoded to a smaller tier
+#  - while the media uses more than the budget, the least recently used events and
+#    files are evicted
+# Files are grouped by inode as the public dir hard links the processor's files, so
+# sizes are only counted once and an event's files are removed together with its row.
+# The process runs at idle io priority so the recorder's writes come first.
+def retention_service(queue, shared):
+    lower_io_priority()
+    dbcon = db.connect()
+    stats = {'expired': 0, 'evicted': 0, 'compacted': 0, 'freed_bytes': 0}
+
+    while True:
+        try:
+            enforce_retention(dbcon, queue, stats)
+        except Exception as e:
+            config.logger.warning('failed to enforce retention', exc_info=e)
+
+        shared['retention'] = dict(stats)
+        sleep(config.RT_INTERVAL_S)
+
+def lower_io_priority():
+    if 'linux' not in platform:
+        return
+
+    os.nice(config.RT_NICENESS)
+    # children such as ffmpeg inherit the class
+    try:
+        subprocess.run(['ionice', '-c', '3', '-p', str(os.getpid())], check=True)
+    except (FileNotFoundError, subprocess.CalledProcessError) as e:
+        config.logger.warning('could not lower the io priority of retention, running at normal priority', exc_info=e)
+
+# files sharing an inode, ie. a processor file and its public links
+class MediaFile:
+    def __init__(self, size, modified_at, used_at):
+        self.paths = []
+        self.size = size
+        self.modified_at = modified_at
+        self.used_at = used_at
+
+# an event's files, or a file which does not belong to an event
+class MediaItem:
+    def __init__(self, event=None):
+        self.event = event
+        self.files = []
+
+    @property
+    def size(self):
+        return sum(f.size for f in self.files)
+
+    @property
+    def used_at(self):
+        return max([f.used_at for f in self.files] or [0])
+
+    @property
+    def modified_at(self):
+        if self.event:
+            return self.event['timestamp'].timestamp()
+        return max([f.modified_at for f in self.files] or [0])
+
+    @property
+    def name(self):
+        return 'event %d' % self.event['id'] if self.event else self.files[0].paths[0]
+
+def media_dirs():
+    return [
+        config.MD_STORAGE_PATH,
+        config.VP_FRAMES_DIR,
+        config.VP_PUBLIC_DIR,
+        config.VP_RENDITIONS_DIR,
+        config.VC_PREPROCESS_CACHE_PATH,
+    ]
+
+def scan_media_files():
+    files = {}
+
+    for media_dir in media_dirs():
+        for root, _, names in os.walk(media_dir):
+            for name in names:
+                path = os.path.realpath(os.path.join(root, name))
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                key = (st.st_dev, st.st_ino)
+                if key not in files:
+                    # atime is only updated once a day with relatime, mtime is the fallback
+                    files[key] = MediaFile(st.st_blocks * 512, st.st_mtime, max(st.st_atime, st.st_mtime))
+                if path not in files[key].paths:
+                    files[key].paths.append(path)
+
+    return list(files.values())
+
+def event_public_names(event):
+    names = [event['video_file_name'], event['frame_file_name']]
+    renditions = event['renditions']
+
+    if renditions:
+        names += [renditions['preview'], renditions['sprite']['file_name']] + list(renditions['thumbnails'].values())
+
+    return [n for n in names if n]
+
+# groups the files on disk by the event they belong to
+def inventory(dbcon):
+    events = db.select_recent_events(dbcon, datetime.fromtimestamp(0, tz=timezone.utc))
+    event_items = {}
+    items_by_path = {}
+
+    for event in events:
+        item = MediaItem(event)
+        event_items[event['id']] = item
+        for name in event_public_names(event):
+            items_by_path[os.path.realpath(config.VP_PUBLIC_DIR + '/' + name)] = item
+
+    items = list(event_items.values())
+    for media_file in scan_media_files():
+        item = next((items_by_path[p] for p in media_file.paths if p in items_by_path), None)
+        if item is None:
+            item = MediaItem()
+            items.append(item)
+        item.files.append(media_file)
+
+    return items
+
+# clips still waiting to be processed, and anything written very recently such as
+# clips being recorded, are never removed
+def is_protected(item, protected_paths, now):
+    if now - item.modified_at < config.RT_MIN_AGE_S or any(now - f.modified_at < config.RT_MIN_AGE_S for f in item.files):
+        return True
+
+    return any(p in protected_paths for f in item.files for p in f.paths)
+
+def enforce_retention(dbcon, queue, stats):
+    now = time()
+    protected_paths = queue.pending_paths()
+    all_items = inventory(dbcon)
+    items = [i for i in all_items if not is_protected(i, protected_paths, now)]
+
+    expired = [i for i in items if now - i.modified_at > config.MD_STORAGE_MAX_AGE]
+    if expired:
+        config.logger.info('removing %d expired events and files' % len(expired))
+        stats['expired'] += len(expired)
+        stats['freed_bytes'] += remove_items(dbcon, expired)
+
+    files_by_path = {p: f for i in all_items for f in i.files for p in f.paths}
+    compact_clips(dbcon, protected_paths, files_by_path, stats)
+
+    # every media file, including the protected ones, counts towards the budget
+    all_items = inventory(dbcon)
+    used = sum(i.size for i in all_items)
+    budget = disk_budget(used)
+    stats['used_bytes'] = used
+    stats['budget_bytes'] = budget
+
+    if used <= budget:
+        return
+
+    # the preprocess cache is rebuilt from the clips when training, so it goes first
+    evict = []
+    over = used - budget
+    remaining = [i for i in all_items if not is_protected(i, protected_paths, now)]
+    for item in sorted(remaining, key=lambda i: (not is_preprocess_cache(i), i.used_at)):
+        if over <= 0:
+            break
+        evict.append(item)
+        over -= item.size
+
+    config.logger.warning('media uses %d MB of a %d MB budget, evicting %d least recently used events and files' % (
+        used // 2**20, budget // 2**20, len(evict)))
+    stats['evicted'] += len(evict)
+    stats['freed_bytes'] += remove_items(dbcon, evict)
+
+def is_preprocess_cache(item):
+    cache_dir = os.path.realpath(config.VC_PREPROCESS_CACHE_PATH) + '/'
+    return item.event is None and all(p.startswith(cache_dir) for f in item.files for p in f.paths)
+
+# the configured budget, lowered if the card itself is running out of space
+def disk_budget(used):
+    free = shutil.disk_usage(config.MD_STORAGE_PATH).free
+    return max(0, min(config.RT_DISK_BUDGET_BYTES, used + free - config.RT_MIN_FREE_BYTES))
+
+# removes items in batches, pausing between them to leave io for the recorder
+def remove_items(dbcon, items):
+    freed = 0
+
+    for start in range(0, len(items), config.RT_DELETE_BATCH):
+        batch = items[start:start + config.RT_DELETE_BATCH]
+
+        # rows first so the api never links to removed files
+        db.delete_events(dbcon, [i.event['id'] for i in batch if i.event])
+
+        for item in batch:
+            for media_file in item.files:
+                for path in media_file.paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                freed += media_file.size
+            config.logger.info('removed %s' % item.name)
+
+        sleep(config.RT_BATCH_PAUSE_S)
+
+    return freed
+
+# files_by_path maps each path in the media dirs to its inode group, see scan_media_files
+def compact_clips(dbcon, protected_paths, files_by_path, stats):
+    before = datetime.now(timezone.utc) - timedelta(seconds=config.RT_COMPACT_AFTER_S)
+
+    for event in db.select_events_to_compact(dbcon, before, config.RT_DELETE_BATCH):
+        if event['clip'] and os.path.realpath(event['clip']) in protected_paths:
+            continue
+
+        public_path = os.path.realpath(config.VP_PUBLIC_DIR + '/' + event['video_file_name'])
+        media_file = files_by_path.get(public_path)
+        freed = compact_clip(public_path, media_file.paths if media_file else [])
+        db.update_event_tier(dbcon, event['id'], 1)
+
+        if freed is not None:
+            stats['compacted'] += 1
+            stats['freed_bytes'] += freed
+
+        sleep(config.RT_BATCH_PAUSE_S)
+
+# Transcodes a clip to the smaller tier and swaps every hard link of it to the new
+# file, keeping the times so its age and lru order are unchanged. links are the paths
+# of the clip's inode found by the inventory. Returns the bytes saved or None if the
+# clip was left as is.
+def compact_clip(public_path, links):
+    try:
+        st = os.stat(public_path)
+    except FileNotFoundError:
+        return None
+
+    paths = [public_path] + [p for p in links if p != public_path and is_same_file(p, st)]
+    compact_path = public_path + '.compact.mp4'
+
+    proc = subprocess.run([
+        'ffmpeg',
+        '-v',
+        'error',
+        '-y',
+        '-threads',
+        '1',
+        '-i',
+        public_path,
+        '-an',
+        '-vf',
+        'scale=%d:-2' % config.RT_COMPACT_WIDTH,
+        '-vcodec',
+        config.MD_H264_CODEC,
+        '-preset',
+        config.MD_H264_PRESET,
+        '-crf',
+        str(config.RT_COMPACT_CRF),
+        '-pix_fmt',
+        'yuv420p',
+        '-movflags',
+        '+faststart',
+        compact_path
+    ])
+
+    if proc.returncode != 0 or not os.path.exists(compact_path) or os.path.getsize(compact_path) >= st.st_size:
+        config.logger.info('not compacting %s' % public_path)
+        if os.path.exists(compact_path):
+            os.remove(compact_path)
+        return None
+
+    saved = st.st_size - os.path.getsize(compact_path)
+    os.utime(compact_path, (st.st_atime, st.st_mtime))
+
+    for path in paths:
+        os.link(compact_path, path + '.compact')
+        os.replace(path + '.compact', path)
+    os.remove(compact_path)
+
+    config.logger.info('compacted %s, saved %d KB' % (public_path, saved // 1024))
+    return saved
+
+# the inventory may be stale by the time a clip is compacted
+def is_same_file(path, st):
+    try:
+        other = os.stat(path)
+    except FileNotFoundError:
+        return False
+
+    return (other.st_dev, other.st_ino) == (st.st_dev, st.st_ino)
+
+if __name__ == '__main__':
+    # prints what the budget would evict without removing anything
+    dbcon = db.connect()
+    items = inventory(dbcon)
+    used = sum(i.size for i in items)
+    print('media uses %d MB, budget %d MB' % (used // 2**20, disk_budget(used) // 2**20))
+    for item in sorted(items, key=lambda i: (not is_preprocess_cache(i), i.used_at))[:20]:
+        print('%-60s %8d KB  last used %s' % (item.name, item.size // 1024, datetime.fromtimestamp(item.used_at).isoformat()))
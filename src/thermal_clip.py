@@ -0,0 +1,85 @@
+import struct
+import os
+import numpy as np
+
+# Compact clip format for the 8x8 thermal camera. A video container costs far
+# more than the 64 pixels it holds and the normalised frames lose the actual
+# temperatures, so clips are instead a small header followed by fixed size
+# records of (timestamp, float16 temperatures). Records are only ever appended,
+# so a clip can be read (or memory-mapped) while it is still being written and a
+# crash only loses the trailing partial record.
+
+THERMAL_CLIP_EXT = '.thermal'
+THERMAL_CLIP_MAGIC = b'THCLIP'
+THERMAL_CLIP_VERSION = 1
+
+# magic, version, reserved, height, width, padded to 16 bytes
+HEADER = struct.Struct('<6sBBHH4x')
+
+def record_dtype(resolution):
+    width, height = resolution
+    return np.dtype([('timestamp', '<f8'), ('temps', '<f2', (height, width))])
+
+class ThermalClipWriter:
+    def __init__(self, clip_path, resolution):
+        self.clip_path = clip_path
+        self.dtype = record_dtype(resolution)
+        self.record = np.zeros((1,), dtype=self.dtype)
+        self.frames = 0
+
+        width, height = resolution
+        self.file = open(clip_path, 'wb')
+        self.file.write(HEADER.pack(THERMAL_CLIP_MAGIC, THERMAL_CLIP_VERSION, 0, height, width))
+
+    def write(self, temps, timestamp):
+        self.record['timestamp'] = timestamp
+        self.record['temps'] = temps
+        self.file.write(self.record.tobytes())
+        # flushed per frame so readers always see whole records
+        self.file.flush()
+        self.frames += 1
+
+    def release(self):
+        self.file.close()
+
+class ThermalClip:
+    def __init__(self, clip_path):
+        self.clip_path = clip_path
+
+        with open(clip_path, 'rb') as f:
+            magic, version, _, height, width = HEADER.unpack(f.read(HEADER.size))
+
+        if magic != THERMAL_CLIP_MAGIC or version != THERMAL_CLIP_VERSION:
+            raise ValueError('%s is not a thermal clip' % clip_path)
+
+        self.resolution = (width, height)
+        dtype = record_dtype(self.resolution)
+        frames = (os.path.getsize(clip_path) - HEADER.size) // dtype.itemsize
+
+        if frames:
+            self.records = np.memmap(clip_path, dtype=dtype, mode='r', offset=HEADER.size, shape=(frames,))
+        else:
+            self.records = np.zeros((0,), dtype=dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    # (frames, height, width) float16 temperatures in celsius
+    @property
+    def temps(self):
+        return self.records['temps']
+
+    @property
+    def duration(self):
+        return float(self.timestamps[-1] - self.timestamps[0]) if len(self) > 1 else 0.0
+
+def open_thermal_clip_writer(base_path, resolution):
+    clip_path = base_path + THERMAL_CLIP_EXT
+    return ThermalClipWriter(clip_path, resolution), clip_path
+
+def read_thermal_clip(clip_path):
+    return ThermalClip(clip_path)
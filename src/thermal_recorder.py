@@ -1,9 +1,11 @@
 from .config import config
 
-from .lib.amg8833_i2c import AMG8833
+from .lib.amg8833_i2c import AMG8833, GE_INTC_DIF
+from .thermal_clip import open_thermal_clip_writer
 import datetime
 import pytz
 import imutils
+from abc import ABC, abstractmethod
 from time import sleep, time
 import cv2
 import numpy as np
@@ -11,14 +13,15 @@ import os
 import astral.sun
 from sys import platform
 
-def start_thermal_recorder(queue = None, shared = {}, debug = False):
+def start_thermal_recorder(queue = None, shared = {}, thermal_motion = None, debug = False):
     thermal_cam = AMG8833(addr=config.TC_ADDR)
 
     sleep(3.0)
 
     prev_frame = None
-    compare_frame = None
-    last_compare_frame_at = None
+    prev_frame_at = None
+    detector = create_thermal_detector()
+    tracker = ThermalDirectionTracker()
 
     state = "STILL"
     state_change_at = None
@@ -26,25 +29,40 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
 
     video = None
     video_path = None
+    last_heartbeat_at = 0
+
+    interrupt_pin = None
+    last_read_at = 0
+
+    if config.TC_INTERRUPT_ENABLED:
+        config.logger.info('enabling thermal camera interrupts')
+        thermal_cam.configure_interrupt(
+            config.TC_INTERRUPT_THRESHOLD_C,
+            -config.TC_INTERRUPT_THRESHOLD_C,
+            config.TC_INTERRUPT_HYSTERESIS_C,
+            GE_INTC_DIF
+        )
+
+        if config.TC_INTERRUPT_GPIO_PIN is not None:
+            from gpiozero import DigitalInputDevice
+            interrupt_pin = DigitalInputDevice(pin=config.TC_INTERRUPT_GPIO_PIN, pull_up=True)
 
     config.logger.info("starting thermal camera loop...")
     os.makedirs(config.TC_STORAGE_PATH, exist_ok=True)
 
+    # clips keep the raw temperatures, see thermal_clip.py
     def start_video_file():
-        video_path = config.TC_STORAGE_PATH + '/thermal.' + datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S') + '.avi'  
-        config.logger.info('writing video to %s' % video_path)
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        video = cv2.VideoWriter(video_path, fourcc, config.TC_MOTION_FPS, config.TC_RESOLUTION)
+        base_path = config.TC_STORAGE_PATH + '/thermal.' + datetime.datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
+        video, video_path = open_thermal_clip_writer(base_path, config.TC_RESOLUTION)
+        config.logger.info('writing thermal clip to %s' % video_path)
         return video, video_path
 
-    def write_frame_to_video(video, frame):
-        frame = frame.reshape(config.TC_RESOLUTION + (1,))
-        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-        video.write(frame)
+    def write_frame_to_video(video, temps, timestamp):
+        video.write(temps, timestamp)
 
     def end_video(video, video_path):
         video.release()
-        config.logger.info('finished writing to video')
+        config.logger.info('finished writing thermal clip (%d frames)' % video.frames)
 
     def normalise_frame(frame):
         # clip to min-max values
@@ -55,8 +73,32 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
 
         return frame
 
+    def wait_for_interrupt():
+        # the sensor compares consecutive frames itself, so while still we only
+        # need the status register (or INT pin) rather than all 64 pixels
+        timeout = 1 / config.TC_STILL_FPS
+
+        if interrupt_pin is not None:
+            interrupt_pin.wait_for_active(timeout=timeout)
+        else:
+            sleep(timeout)
+
+        return thermal_cam.interrupt_flagged() or time() - last_read_at > config.TC_INTERRUPT_REFRESH_S
+
     while True:
+        if time() - last_heartbeat_at > config.TC_HEARTBEAT_INTERVAL_S:
+            shared['thermal_alive_at'] = time()
+            last_heartbeat_at = time()
+
+        if config.TC_INTERRUPT_ENABLED and state == "STILL" and prev_frame is not None:
+            if not wait_for_interrupt():
+                continue
+
         error, frame = thermal_cam.read_temp()
+        frame_at = last_read_at = time()
+
+        if config.TC_INTERRUPT_ENABLED:
+            thermal_cam.clear_interrupt()
 
         # if the frame could not be grabbed, then we have reached the end
         # of the video
@@ -67,29 +109,42 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
         temp_frame = frame
         frame = normalise_frame(frame)
 
-        if compare_frame is None:
-            compare_frame = temp_frame
-            last_compare_frame_at = time()
-            continue
+        result = detector.detect(temp_frame)
+        detected_motion = result.detected
 
-        frameDelta = cv2.absdiff(compare_frame, temp_frame)
-        thresh = cv2.threshold(frameDelta, config.TC_CHANGE_TEMP_PIXEL_THRESHOLD, config.TC_MAX_TEMP_C, cv2.THRESH_BINARY)[1]
-
-        # calculate portion of pixels that changed
-        detected_motion = np.count_nonzero(thresh) > config.TC_CHANGE_TEMP_IMAGE_THRESHOLD_PIXELS
+        if state == "MOTION" or detected_motion:
+            tracker.update(result.blob, frame_at)
 
         if detected_motion:
             last_motion_at = time()
 
+        # wakes the motion recorder when it is gated on thermal motion
+        if thermal_motion is not None:
+            if detected_motion or state == "MOTION":
+                thermal_motion.set()
+            else:
+                thermal_motion.clear()
+
         motion_duration = time() - state_change_at if state_change_at else 0
         stillness_duration = time() - last_motion_at if last_motion_at else 0
 
         def end_motion():
-            nonlocal state, state_change_at, compare_frame, video, video_path
+            nonlocal state, state_change_at, video, video_path
             end_video(video, video_path)
 
+            direction, confidence = tracker.estimate()
+            if direction:
+                config.logger.info('thermal direction %d (confidence %.2f)' % (direction, confidence))
+
             if queue is not None:
-                queue.put({'type': 'thermal', 'path': video_path})
+                queue.put({
+                    'type': 'thermal',
+                    'path': video_path,
+                    'started_at': tracker.started_at,
+                    'ended_at': tracker.ended_at,
+                    'direction': direction,
+                    'direction_confidence': confidence,
+                })
 
             state = "STILL"
             state_change_at = time()
@@ -99,16 +154,18 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
         # start recording
         if state == "STILL" and detected_motion:
             config.logger.info('motion started')
+            tracker.reset()
+            tracker.update(result.blob, frame_at)
             state = "MOTION"
             state_change_at = time()
             video, video_path = start_video_file()
             if prev_frame is not None:
-                write_frame_to_video(video, prev_frame)
-            write_frame_to_video(video, frame)
+                write_frame_to_video(video, prev_frame, prev_frame_at)
+            write_frame_to_video(video, temp_frame, frame_at)
         # stop recording (max duration exceeded)
         elif state == "MOTION" and motion_duration > config.TC_MAX_DURATION_S:
             config.logger.info('motion stopped (max time exceeded)')
-            write_frame_to_video(video, frame)
+            write_frame_to_video(video, temp_frame, frame_at)
             end_motion()
         # stop recording (motion stopped)
         elif state == "MOTION" and stillness_duration > config.TC_MIN_DURATION_S:
@@ -116,18 +173,14 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
             end_motion()
         # continue recording
         elif state == "MOTION":
-            write_frame_to_video(video, frame)
+            write_frame_to_video(video, temp_frame, frame_at)
 
         sleep_interval = 1 / (config.TC_STILL_FPS if state == "STILL" else config.TC_MOTION_FPS)
         sleep(sleep_interval)
 
         # keep previous frame for writing to video if motion occurs
-        prev_frame = frame
-
-        # use latest motion frame to compare with next frame
-        if detected_motion or time() - last_compare_frame_at > 60:
-            compare_frame = temp_frame
-            last_compare_frame_at = time()
+        prev_frame = temp_frame
+        prev_frame_at = frame_at
 
         if debug:
             # draw the text and timestamp on the frame
@@ -138,8 +191,8 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
 
             # show the frame and record if the user presses a key
             cv2.imshow("Security Feed", frame)
-            cv2.imshow("Thresh", thresh)
-            cv2.imshow("Frame Delta", frameDelta)
+            cv2.imshow("Thresh", result.mask.astype('uint8') * 255)
+            cv2.imshow("Frame Delta", normalise_frame(result.delta + config.TC_MIN_TEMP_C))
             key = cv2.waitKey(1) & 0xFF
 
             # if the `q` key is pressed, break from the lop
@@ -147,8 +200,160 @@ def start_thermal_recorder(queue = None, shared = {}, debug = False):
                 break
 
     # cleanup the camera and close any open windows
+    if interrupt_pin is not None:
+        interrupt_pin.close()
     cv2.destroyAllWindows()
 
+# A connected group of warm pixels, centroid is (x, y) in sensor pixels
+class ThermalBlob:
+    def __init__(self, size, centroid, peak_c):
+        self.size = size
+        self.centroid = centroid
+        self.peak_c = peak_c
+
+class ThermalResult:
+    def __init__(self, detected, blobs, delta, mask):
+        self.detected = detected
+        # largest first
+        self.blobs = blobs
+        # temperature above the background
+        self.delta = delta
+        self.mask = mask
+
+    @property
+    def blob(self):
+        return self.blobs[0] if self.blobs else None
+
+# Interface for thermal detectors, detect() is called with each frame of
+# temperatures and returns any warm blobs
+class ThermalDetector(ABC):
+    @abstractmethod
+    def detect(self, temps) -> ThermalResult:
+        pass
+
+    def result(self, temps, delta, mask, detected=None):
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask.astype('uint8'), connectivity=8)
+
+        blobs = []
+        for label in range(1, count):
+            blobs.append(ThermalBlob(
+                size=int(stats[label, cv2.CC_STAT_AREA]),
+                centroid=(float(centroids[label][0]), float(centroids[label][1])),
+                peak_c=float(temps[labels == label].max())
+            ))
+        blobs.sort(key=lambda b: b.size, reverse=True)
+
+        if detected is None:
+            detected = bool(blobs) and blobs[0].size >= config.TC_MIN_BLOB_PIXELS
+
+        return ThermalResult(detected, blobs, delta, mask)
+
+# Compares against a single frame refreshed each minute (or on motion)
+class ThermalCompareDetector(ThermalDetector):
+    def __init__(self):
+        self.compare_frame = None
+        self.last_compare_frame_at = None
+
+    def detect(self, temps):
+        if self.compare_frame is None:
+            self.compare_frame = temps
+            self.last_compare_frame_at = time()
+
+        delta = temps - self.compare_frame
+        mask = np.abs(delta) > config.TC_CHANGE_TEMP_PIXEL_THRESHOLD
+        result = self.result(temps, delta, mask, np.count_nonzero(mask) > config.TC_CHANGE_TEMP_IMAGE_THRESHOLD_PIXELS)
+
+        # use latest motion frame to compare with next frame
+        if result.detected or time() - self.last_compare_frame_at > 60:
+            self.compare_frame = temps
+            self.last_compare_frame_at = time()
+
+        return result
+
+# Keeps an exponentially weighted mean and variance of each pixel so slow ambient
+# drift (eg. the sun warming the courtyard) is learnt, only pixels which are both
+# warmer than the background by TC_CHANGE_TEMP_PIXEL_THRESHOLD and a z-score
+# outlier count as a warm blob
+class ThermalBackgroundDetector(ThermalDetector):
+    def __init__(self):
+        self.mean = None
+        self.var = None
+        self.delta = None
+        self.rate = None
+
+    def detect(self, temps):
+        if self.mean is None:
+            self.mean = temps.astype('float32')
+            self.var = np.full(temps.shape, config.TC_BG_MIN_STD ** 2, dtype='float32')
+            self.delta = np.zeros(temps.shape, dtype='float32')
+            self.rate = np.zeros(temps.shape, dtype='float32')
+
+        np.subtract(temps, self.mean, out=self.delta)
+
+        mask = (self.delta > config.TC_CHANGE_TEMP_PIXEL_THRESHOLD) & (np.square(self.delta) > self.var * config.TC_BG_Z_THRESHOLD ** 2)
+        result = self.result(temps, self.delta.copy(), mask)
+
+        # warm pixels are learnt slowly so a pet sitting still does not vanish into the background
+        self.rate[:] = config.TC_BG_LEARNING_RATE
+        self.rate[mask] = config.TC_BG_FOREGROUND_LEARNING_RATE
+
+        self.mean += self.rate * self.delta
+        self.var += self.rate * (np.square(self.delta) - self.var)
+        np.maximum(self.var, config.TC_BG_MIN_STD ** 2, out=self.var)
+
+        return result
+
+# Follows the largest blob's centroid through a clip to estimate which way it
+# crossed the door. Positions are projected onto TC_INSIDE_DIRECTION, confidence
+# grows with the distance travelled and how consistently it moved that way.
+class ThermalDirectionTracker:
+    def __init__(self):
+        inside = np.array(config.TC_INSIDE_DIRECTION, dtype='float32')
+        self.inside = inside / np.linalg.norm(inside)
+        self.reset()
+
+    def reset(self):
+        self.positions = []
+        self.started_at = None
+        self.ended_at = None
+
+    def update(self, blob, timestamp):
+        if self.started_at is None:
+            self.started_at = timestamp
+        self.ended_at = timestamp
+
+        if blob is not None and blob.size >= config.TC_MIN_BLOB_PIXELS:
+            self.positions.append(float(np.dot(blob.centroid, self.inside)))
+
+    # returns (event class, confidence) or (None, 0.0) if there is too little to go on
+    def estimate(self):
+        if len(self.positions) < config.TC_DIRECTION_MIN_FRAMES:
+            return None, 0.0
+
+        positions = np.array(self.positions)
+        ends = max(1, len(positions) // 3)
+        travel = np.median(positions[-ends:]) - np.median(positions[:ends])
+
+        if travel == 0:
+            return None, 0.0
+
+        steps = np.sign(np.diff(positions))
+        steps = steps[steps != 0]
+        consistency = abs(steps.sum()) / len(steps) if len(steps) else 0.0
+
+        confidence = min(1.0, abs(travel) / config.TC_DIRECTION_FULL_TRAVEL_PX) * consistency
+        direction = config.VC_EVENT_CLASSES['WENT_INSIDE' if travel > 0 else 'WENT_OUTSIDE']
+
+        return direction, float(confidence)
+
+def create_thermal_detector() -> ThermalDetector:
+    if config.TC_DETECTOR == 'compare':
+        return ThermalCompareDetector()
+    elif config.TC_DETECTOR == 'background':
+        return ThermalBackgroundDetector()
+
+    raise ValueError('unknown thermal detector %s' % config.TC_DETECTOR)
+
 if __name__ == '__main__':
     print('pid: ', os.getpid())
     start_thermal_recorder(debug=True)
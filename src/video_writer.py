@@ -0,0 +1,210 @@
+from .config import config
+
+from time import monotonic
+import subprocess
+import threading
+import queue
+import cv2
+import numpy as np
+import os
+
+# Streams raw BGR frames into an ffmpeg process encoding H.264 so clips come out
+# as web playable mp4 without a later transcode. The file is written under a
+# temporary name and only renamed into place once ffmpeg has finalised it (moving
+# the moov atom to the front for faststart playback). max_bitrate caps the rate
+# for renditions streamed over slow connections.
+class FfmpegVideoWriter:
+    def __init__(self, video_path, fps, resolution, crf=None, max_bitrate=None, threads=None):
+        self.video_path = video_path
+        self.part_path = video_path + '.part'
+        self.frames = 0
+        self.failed = False
+
+        self.proc = subprocess.Popen([
+                'ffmpeg',
+                '-hide_banner',
+                '-loglevel',
+                'error',
+                '-y',
+                '-f',
+                'rawvideo',
+                '-pix_fmt',
+                'bgr24',
+                '-s',
+                '%dx%d' % resolution,
+                '-r',
+                str(fps),
+                '-i',
+                '-',
+                '-an',
+                '-vcodec',
+                config.MD_H264_CODEC,
+                '-preset',
+                config.MD_H264_PRESET,
+                '-crf',
+                str(crf or config.MD_H264_CRF),
+            ] + (['-maxrate', max_bitrate, '-bufsize', max_bitrate] if max_bitrate else []) + [
+                '-pix_fmt',
+                'yuv420p',
+                '-threads',
+                str(threads or config.MD_H264_THREADS),
+                '-movflags',
+                '+faststart',
+                '-f',
+                'mp4',
+                self.part_path
+            ],
+            stdin=subprocess.PIPE
+        )
+
+    def write(self, frame):
+        if self.failed:
+            return
+
+        try:
+            self.proc.stdin.write(np.ascontiguousarray(frame).data)
+            self.frames += 1
+        except BrokenPipeError:
+            config.logger.error('ffmpeg stopped accepting frames for %s' % self.video_path)
+            self.failed = True
+
+    # returns whether the video was written, on failure nothing is left at video_path
+    def release(self):
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            self.failed = True
+
+        exit_code = self.proc.wait()
+
+        if self.failed or exit_code != 0:
+            config.logger.error('ffmpeg exited with code %d while encoding %s' % (exit_code, self.video_path))
+            self.failed = True
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+            return False
+
+        os.replace(self.part_path, self.video_path)
+        return True
+
+# Writes frames on a background thread so the capture loop never blocks on disk or
+# encoder stalls. The queue is bounded, frames are dropped (and counted) when it is
+# full. Queued frames are pinned in the frame ring buffer until they are written.
+class AsyncVideoWriter:
+    def __init__(self, writer, video_path, frame_buffer=None, max_queued=None):
+        self.writer = writer
+        self.video_path = video_path
+        self.frame_buffer = frame_buffer
+        self.queue = queue.Queue(maxsize=max_queued or config.MD_WRITER_QUEUE_FRAMES)
+        self.on_released = None
+        # set once released if the video could not be written
+        self.failed = False
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.total_depth = 0
+        self.max_write_s = 0
+
+        self.thread = threading.Thread(target=self.run, name='video writer', daemon=True)
+        self.thread.start()
+
+    # returns the index of the frame in the video, or None if it was dropped
+    def write(self, frame):
+        if frame is None:
+            self.dropped += 1
+            return None
+
+        if self.frame_buffer is not None:
+            self.frame_buffer.pin(frame)
+
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.unpin(frame)
+            self.dropped += 1
+            return None
+
+        depth = self.queue.qsize()
+        self.queued += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+        return self.queued - 1
+
+    # runs callback on the writer thread after the frames queued so far, for io which
+    # must not block capture. Returns False (and never calls it) if the queue is full.
+    def defer(self, callback):
+        try:
+            self.queue.put_nowait(callback)
+        except queue.Full:
+            return False
+
+        return True
+
+    # returns immediately, on_released is called from the writer thread once every
+    # queued frame has been written and the video has been finalised
+    def release(self, on_released=None):
+        self.on_released = on_released
+        self.queue.put(None)
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+
+            if frame is None:
+                break
+
+            if callable(frame):
+                try:
+                    frame()
+                except Exception as e:
+                    config.logger.warning('deferred call on the writer of %s failed' % self.video_path, exc_info=e)
+                continue
+
+            started_at = monotonic()
+            self.writer.write(frame)
+            self.max_write_s = max(self.max_write_s, monotonic() - started_at)
+            self.written += 1
+            self.unpin(frame)
+
+        self.writer.release()
+        # cv2's VideoWriter does not report failures
+        self.failed = getattr(self.writer, 'failed', False)
+
+        config.logger.info('finished writing %s (%d frames written, %d dropped, queue depth max %d avg %.1f, slowest write %.0f ms)'
+            % (self.video_path, self.written, self.dropped, self.max_depth, self.total_depth / max(1, self.queued), self.max_write_s * 1000))
+
+        if self.on_released is not None:
+            self.on_released()
+
+    # waits for the video to be finalised, returns False on timeout
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_depth,
+            'max_write_s': self.max_write_s,
+        }
+
+    def unpin(self, frame):
+        if self.frame_buffer is not None:
+            self.frame_buffer.unpin(frame)
+
+def open_video_writer(base_path, fps, resolution):
+    if config.MD_VIDEO_ENCODER == 'h264':
+        try:
+            video_path = base_path + '.mp4'
+            return FfmpegVideoWriter(video_path, fps, resolution), video_path
+        except OSError as e:
+            config.logger.warning('could not start ffmpeg, falling back to xvid', exc_info=e)
+
+    video_path = base_path + '.avi'
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    return cv2.VideoWriter(video_path, fourcc, fps, resolution, isColor=True), video_path